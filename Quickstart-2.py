@@ -5,6 +5,7 @@
 #3 Static Files
 #4 Rendering Templates
 #5 The Request Object
+#6 Checking Passwords
 
 # URL Building
 # https://flask.palletsprojects.com/en/1.1.x/quickstart/#url-building
@@ -30,20 +31,99 @@ def login():
 def profile(username):
     return f"{username}'s Profile"
 
-with app.test_request_context():
-    print(url_for('index'))
-    print(url_for('login'))
-    print(url_for('login', next='/'))
-    print(url_for('profile', username='John Doe'))
+# To see what they build, run:
+# >flask url-examples
+# (It's a command, so importing the app doesn't print anything or set up a test
+# request every time it starts.)
+@app.cli.command('url-examples')
+def url_examples():
+    with app.test_request_context():
+        print(url_for('index'))
+        print(url_for('login'))
+        print(url_for('login', next='/'))
+        print(url_for('profile', username='John Doe'))
 # Example Use Case:
 # https://stackoverflow.com/a/35936261/15110097
 
 
+# Building Lots Of URLs
+# Every url_for() call looks up the rules of the endpoint and asks each of them
+# to build the URL. That's fast enough for a few links, but a page that links
+# to thousands of profiles spends a noticeable amount of time in url_for().
+
+# For an endpoint with a single rule the URL always has the same shape, so the
+# rule can be turned into a format string once ('/user/<username>' becomes
+# '/user/{username}') and filled in afterwards. Values still go through the
+# rule's converter, so they're quoted exactly like url_for() does it.
+# Endpoints without variables (like index) are built completely, only once
+# (per script_root, the path the app is mounted at) and kept in static_urls.
+import re
+from functools import lru_cache
+from flask import request
+
+VARIABLE_RE = re.compile(r'<(?:[^<>:]+:)?([^<>:]+)>')
+
+@lru_cache(maxsize=None)
+def compile_url(endpoint):
+    rules = list(app.url_map.iter_rules(endpoint))
+    if len(rules) != 1 or rules[0].defaults or rules[0].host or rules[0].subdomain:
+        return None # Leave the tricky cases to url_for()
+    rule = rules[0]
+    template = rule.rule.replace('{', '{{').replace('}', '}}')
+    template = VARIABLE_RE.sub(r'{\1}', template)
+    # _converters isn't a public attribute, it holds the converter of each variable.
+    return template, rule._converters
+
+static_urls = {}
+
+def fast_url_for(endpoint, **values):
+    if not values:
+        url = static_urls.get((request.script_root, endpoint))
+        if url is not None:
+            return url
+    compiled = compile_url(endpoint)
+    if compiled is None or values.keys() != compiled[1].keys():
+        # Extra values become query parameters, url_for() handles those.
+        return url_for(endpoint, **values)
+    template, converters = compiled
+    url = request.script_root + template.format(
+        **{name: converters[name].to_url(value) for name, value in values.items()}
+    )
+    if not values:
+        static_urls[(request.script_root, endpoint)] = url
+    return url
+
+# Builds the URL for every value in one go, e.g.
+# urls_for('profile', 'username', ['John Doe', 'Jane Doe'])
+def urls_for(endpoint, name, values):
+    compiled = compile_url(endpoint)
+    if compiled is None or compiled[1].keys() != {name}:
+        return [url_for(endpoint, **{name: value}) for value in values]
+    template, converters = compiled
+    to_url = converters[name].to_url
+    script_root = request.script_root
+    return [script_root + template.format(**{name: to_url(value)}) for value in values]
+
+# >flask fast-url-examples
+@app.cli.command('fast-url-examples')
+def fast_url_examples():
+    with app.test_request_context():
+        print(fast_url_for('index'))
+        print(fast_url_for('login', next='/'))
+        print(urls_for('profile', 'username', ['John Doe', 'Jane Doe']))
+
+# Just like url_for() these need a request context, and the rules are only
+# compiled once, so don't add routes after the first URL has been built.
+
+
 
 # --References--
 # url_for(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.url_for
 # test_request_context(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.Flask.test_request_context
 # Context Locals: https://flask.palletsprojects.com/en/1.1.x/quickstart/#context-locals
+# iter_rules(): https://werkzeug.palletsprojects.com/en/1.0.x/routing/#werkzeug.routing.Map.iter_rules
+# Custom Converters: https://werkzeug.palletsprojects.com/en/1.0.x/routing/#custom-converters
+# lru_cache(): https://docs.python.org/3/library/functools.html#functools.lru_cache
 
 
 
@@ -91,6 +171,157 @@ def login2():
 # The file has to be stored on the filesystem as 'static/style.css'
 
 
+# Compressing Responses
+# Text (HTML, CSS, JS, JSON) compresses very well, often to a fifth of its size.
+# Browsers tell the server which compressions they understand with the
+# Accept-Encoding header, e.g. 'gzip, deflate, br, zstd'. The after_request
+# function below picks the best one it has and compresses the response.
+# gzip comes with Python, brotli (pip install brotli) and zstd
+# (pip install zstandard) are used when they're installed.
+# Responses that are streamed (see Streaming Contents in the docs) are
+# compressed piece by piece as they're sent, so they're never all in memory.
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Small responses aren't worth it, the compressed version can even end up bigger.
+app.config['COMPRESS_MIN_SIZE'] = 500
+COMPRESSIBLE_TYPES = {'application/json', 'application/javascript', 'image/svg+xml'}
+
+# For every encoding a function that returns a new (compress, flush, finish)
+# triple. Compressors keep data back until they have enough of it, flush()
+# makes them hand out everything they got so far (for streamed responses).
+def gzip_compressor():
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # 31 means: with a gzip header
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+def zstd_compressor():
+    compressor = zstandard.ZstdCompressor().compressobj()
+    return (compressor.compress, lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            compressor.flush)
+
+def brotli_compressor():
+    compressor = brotli.Compressor()
+    return compressor.process, compressor.flush, compressor.finish
+
+compressors = {'gzip': gzip_compressor}
+if zstandard is not None:
+    compressors['zstd'] = zstd_compressor
+if brotli is not None:
+    compressors['br'] = brotli_compressor
+
+def compress_chunks(chunks, compress, flush, finish):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        # Flushing after every chunk sends each one as soon as it's ready, instead
+        # of waiting until the compressor has collected enough data.
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+@app.after_request
+def compress_response(response):
+    if ('Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough # Files from send_file(), see the static part below
+            or not (response.mimetype.startswith('text/') or response.mimetype in COMPRESSIBLE_TYPES)):
+        return response
+    if not response.is_streamed and len(response.get_data()) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    # Preference order: brotli and zstd compress better than gzip.
+    encoding = request.accept_encodings.best_match([e for e in ('br', 'zstd', 'gzip') if e in compressors])
+    if encoding is None:
+        return response
+    compress, flush, finish = compressors[encoding]()
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, compress, flush, finish)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compress(response.get_data()) + finish())
+    response.headers['Content-Encoding'] = encoding
+    # The compressed body is a different body, so it needs a different ETag.
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+
+# Precompressed Static Files
+# Static files never change while the app runs, so there's no point in
+# compressing them again for every request. Instead compress them once when
+# you deploy, next to the original: static/style.css.gz and static/style.css.br
+# >flask precompress-static
+# Then the static endpoint is replaced with one that sends the compressed file
+# if the browser accepts it, and the original otherwise.
+import mimetypes
+import os
+from flask import send_from_directory
+
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+@app.cli.command('precompress-static')
+def precompress_static():
+    if not os.path.isdir(app.static_folder):
+        return
+    for root, _, files in os.walk(app.static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(('.gz', '.br')) or os.path.getsize(path) < app.config['COMPRESS_MIN_SIZE']:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            with open(path + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, 9))
+            if brotli is not None:
+                with open(path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data))
+
+def send_static(filename):
+    for encoding, suffix in PRECOMPRESSED:
+        if (request.accept_encodings[encoding]
+                and os.path.isfile(os.path.join(app.static_folder, filename + suffix))):
+            # The mimetype is guessed from the original name, not from the .gz/.br one.
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+    response = app.send_static_file(filename)
+    response.vary.add('Accept-Encoding')
+    return response
+
+app.view_functions['static'] = send_static
+
+# Note that in production it's usually better to let the web server (like nginx
+# with gzip_static on) serve the static folder, see the deployment options.
+
+
+
+# --References--
+# Static Files: https://flask.palletsprojects.com/en/1.1.x/quickstart/#static-files
+# after_request(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.Flask.after_request
+# Streaming Contents: https://flask.palletsprojects.com/en/1.1.x/patterns/streaming/
+# send_from_directory(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.send_from_directory
+# Accept-Encoding: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Accept-Encoding
+# zlib: https://docs.python.org/3/library/zlib.html
+# brotli: https://pypi.org/project/Brotli/
+# zstandard: https://pypi.org/project/zstandard/
+# nginx gzip_static: https://nginx.org/en/docs/http/ngx_http_gzip_static_module.html
+
+
 
 
 
@@ -140,6 +371,254 @@ def hello(name=None):
 # as always, head to Jinja2 Documentation for more examples:
 
 
+# Caching Compiled Templates
+# Before a template can be rendered Jinja has to parse it and compile it to
+# Python code. Jinja keeps the compiled templates in an in-memory LRU cache
+# (400 templates by default) so that only happens once per process, but every
+# new worker process still pays for it on its first render of each template.
+
+# A bytecode cache stores the compiled code on disk, so the next process can
+# load it instead of compiling again. cache_size sets how many loaded templates
+# the in-memory LRU cache holds. Both are set through jinja_options, which has
+# to be done before the first template is rendered.
+from jinja2 import FileSystemBytecodeCache
+
+app.jinja_options = dict(
+    app.jinja_options,
+    cache_size=100,
+    # Without a directory it uses a folder in the system's temp directory.
+    bytecode_cache=FileSystemBytecodeCache(),
+)
+
+# Loading every template up front means no request has to wait for it.
+# It's not done when the app is imported, that would make every start slower
+# (think of new instances started by autoscaling). serve.py does it once in the
+# master process before it starts the workers, and you can fill the bytecode
+# cache at build/deploy time with:
+# >flask precompile-templates
+def precompile_templates():
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+@app.cli.command('precompile-templates')
+def precompile_templates_command():
+    precompile_templates()
+
+# When auto reload is on, Jinja also checks if the template file changed on disk
+# (a stat() call) every time it's rendered. Flask only turns it on in debug mode,
+# unless TEMPLATES_AUTO_RELOAD is set, so don't set it to True in production.
+
+# To see the difference, restart the server and time the very first request,
+# once with the bytecode cache and once without it:
+# >curl -o /dev/null -s -w "%{time_total}\n" 127.0.0.1:5000/hello/John
+
+
+# Caching Rendered Pages
+# The hello page only depends on 'name', yet the template is rendered again on
+# every request. When a page only depends on a few inputs you can cache the
+# rendered result, keyed on the endpoint and those inputs, and skip rendering
+# (and the view function itself) until the entry expires.
+
+# A cache backend only needs a get(key) and a set(key, value, ttl) method.
+# MemoryCache keeps entries in this process. It drops the least recently used
+# entries when there are too many of them or they take too much memory.
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+class MemoryCache:
+    def __init__(self, max_items=1000, max_size=16 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_size = max_size # in characters
+        self.items = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self.items[key]
+                self.size -= len(value)
+                return None
+            self.items.move_to_end(key) # Mark as most recently used
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            if key in self.items:
+                self.size -= len(self.items.pop(key)[1])
+            self.items[key] = (time.monotonic() + ttl, value)
+            self.size += len(value)
+            while len(self.items) > self.max_items or self.size > self.max_size:
+                _, (_, old_value) = self.items.popitem(last=False)
+                self.size -= len(old_value)
+
+# FileCache keeps every entry in its own file, so all worker processes on the
+# same machine share it. Point it at a tmpfs folder like /dev/shm to keep it in
+# memory. The file's modification time is used to find the least recently used.
+class FileCache:
+    TMP_SUFFIX = '.tmp'
+
+    def __init__(self, folder=os.path.join(tempfile.gettempdir(), 'response_cache'), max_items=1000):
+        self.folder = folder
+        self.max_items = max_items
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.folder, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self.path(key), encoding='utf-8') as f:
+                expires = float(f.readline())
+                value = f.read()
+        except (OSError, ValueError):
+            return None
+        if expires < time.time():
+            return None
+        try:
+            os.utime(self.path(key)) # Mark as most recently used
+        except OSError:
+            pass # Another worker removed it just now, what we read is still fine.
+        return value
+
+    def set(self, key, value, ttl):
+        # Other workers write and evict at the same time, so any file may be gone
+        # by the time we get to it. Files that are still being written end with
+        # TMP_SUFFIX and are left alone when evicting.
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.folder,
+                                         suffix=self.TMP_SUFFIX, delete=False) as f:
+            f.write(f'{time.time() + ttl}\n{value}')
+        try:
+            os.replace(f.name, self.path(key))
+        except FileNotFoundError:
+            return
+        files = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(self.TMP_SUFFIX):
+                continue
+            try:
+                files.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+        if len(files) > self.max_items:
+            files.sort()
+            for _, path in files[:len(files) - self.max_items]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass # Another worker evicted it already.
+
+# The cached() decorator builds the key from the endpoint, the URL variables
+# and the cookies you name, so e.g. every username gets its own entry.
+# Only string return values are cached, anything else (for example a response
+# that sets a cookie) is returned as it is.
+cache_stats = {}
+
+def cached(ttl=60, cookies=(), cache=MemoryCache()):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            stats = cache_stats.setdefault(request.endpoint, {'hits': 0, 'misses': 0})
+            key = repr((request.endpoint, sorted(kwargs.items()),
+                        [request.cookies.get(name) for name in cookies]))
+            value = cache.get(key)
+            if value is not None:
+                stats['hits'] += 1
+                return value
+            stats['misses'] += 1
+            value = view(**kwargs)
+            if isinstance(value, str):
+                cache.set(key, value, ttl)
+            return value
+        return wrapper
+    return decorator
+
+# Note that cached() has to be placed below route(), otherwise the route would
+# register the uncached function.
+@app.route('/hello2/')
+@app.route('/hello2/<name>')
+@cached(ttl=300)
+def hello2(name=None):
+    return render_template('hello.html', name=name)
+
+# The cookies() view of Quickstart-3 could be cached the same way with:
+# @cached(ttl=300, cookies=['username'])
+
+@app.route('/cache_stats')
+def show_cache_stats():
+    return cache_stats
+
+# Of course only cache pages that don't show anything else that changes,
+# otherwise users would see an outdated page until the entry expires.
+
+
+# Streaming Templates
+# render_template() builds the whole page as one string before anything is
+# sent. For a page with a long list that means the browser waits until the
+# last item is rendered, and the whole page is in memory at once.
+# stream_template() (Flask 2.2+) renders the template piece by piece while the
+# response is being sent instead. Jinja hands out very small pieces (every bit
+# of text between two tags), so flush_every() collects them and only sends
+# once it has TEMPLATE_FLUSH_SIZE characters. Every request then only holds
+# about that much of the page in memory, however long the page is.
+from flask import Response, abort, stream_template
+
+app.config['TEMPLATE_FLUSH_SIZE'] = 8 * 1024
+
+def flush_every(chunks, size):
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def stream_page(template_name, flush_size=None, **context):
+    chunks = stream_template(template_name, **context)
+    return Response(flush_every(chunks, flush_size or app.config['TEMPLATE_FLUSH_SIZE']),
+                    mimetype='text/html')
+
+@app.route('/hello3/')
+@app.route('/hello3/<name>')
+def hello3(name=None):
+    return stream_page('hello.html', name=name)
+
+# The status code and headers are sent together with the first piece, so
+# everything that can fail (like a page that doesn't exist) has to be checked
+# before the page is returned. abort(404) then goes through the 404 error
+# handler like in every other view. The template is also loaded by
+# stream_template() right away, so a missing template is still a normal error.
+USERS_PER_PAGE = 10000
+USER_PAGES = 10
+
+@app.route('/users/')
+@app.route('/users/<int:page>')
+def user_list(page=0):
+    if page >= USER_PAGES:
+        abort(404)
+    first = page * USERS_PER_PAGE
+    # A generator, so not even the list of names is in memory all at once.
+    users = (f'User {number}' for number in range(first, first + USERS_PER_PAGE))
+    return stream_page('list.html', title=f'Users, page {page}', items=users)
+
+# The compression above compresses streamed pages piece by piece, and pages
+# from cached() aren't streamed at all, only strings are kept in its cache.
+
+
 
 # --References--
 # Jinja2: http://jinja.pocoo.org/
@@ -151,6 +630,15 @@ def hello(name=None):
 # get_flashed_messages(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.get_flashed_messages
 # Template Inheritance: https://flask.palletsprojects.com/en/1.1.x/patterns/templateinheritance/#template-inheritance
 # Markup: https://jinja.palletsprojects.com/en/2.11.x/api/#jinja2.Markup
+# Bytecode Cache: https://jinja.palletsprojects.com/en/2.11.x/api/#bytecode-cache
+# jinja_options: https://flask.palletsprojects.com/en/1.1.x/api/#flask.Flask.jinja_options
+# TEMPLATES_AUTO_RELOAD: https://flask.palletsprojects.com/en/1.1.x/config/#TEMPLATES_AUTO_RELOAD
+# stream_template(): https://flask.palletsprojects.com/en/2.2.x/api/#flask.stream_template
+# Streaming Contents: https://flask.palletsprojects.com/en/2.2.x/patterns/streaming/
+# Custom Commands: https://flask.palletsprojects.com/en/1.1.x/cli/#custom-commands
+# View Decorators: https://flask.palletsprojects.com/en/1.1.x/patterns/viewdecorators/
+# Caching Decorator: https://flask.palletsprojects.com/en/1.1.x/patterns/viewdecorators/#caching-decorator
+# OrderedDict: https://docs.python.org/3/library/collections.html#collections.OrderedDict
 
 
 
@@ -207,3 +695,134 @@ def login3():
 # request.method: https://flask.palletsprojects.com/en/1.1.x/api/#flask.Request.method
 # request.form: https://flask.palletsprojects.com/en/1.1.x/api/#flask.Request.form
 # request.args: https://flask.palletsprojects.com/en/1.1.x/api/#flask.Request.args
+
+
+
+
+
+# Checking Passwords
+# login3 above calls valid_login() but never shows it. Passwords should be
+# stored as hashes, which werkzeug.security can make and check for you:
+# generate_password_hash('secret') and check_password_hash(pwhash, 'secret').
+# Checking a hash is slow on purpose (so stolen hashes are hard to crack), which
+# also means a flood of login attempts can keep all your workers busy.
+
+# Three things help against that:
+#1 The hash is checked in a separate process (ProcessPoolExecutor), so it runs
+#  on its own CPU core and doesn't hold up the other threads of this process.
+#2 Too many attempts for the same username or from the same IP address within
+#  a time window are refused with 429 Too Many Requests before hashing anything.
+#3 A wrong username/password pair that was just tried is remembered for a
+#  while, so trying it again doesn't cost another hash check.
+import hmac
+import secrets
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from flask import abort
+from werkzeug.security import check_password_hash
+
+# Pretend database, the password of John Doe is 'secret'.
+users = {
+    'John Doe': 'pbkdf2:sha256:1000000$beC4g597UDxGkNsl$3ea517aed015fe917a6ff728f5b071eae151730c2a069060b6c9c0d3188db346',
+}
+# Unknown usernames are checked against this hash, so that they take just as
+# long as known ones and nobody can find out which usernames exist by timing it.
+DUMMY_HASH = 'pbkdf2:sha256:1000000$B5S1ZPpyWKBm94Ox$a8288d7871572b0c93e0870cc5758d5aabf5babaf2493f75012e390a8ccae0f4'
+
+password_pool = ProcessPoolExecutor(max_workers=2)
+
+# Keeps the times of the attempts made within the last 'window' seconds for every key.
+class SlidingWindowLimiter:
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.attempts = {} # key -> deque of times
+        self.lock = threading.Lock()
+        self.last_sweep = time.monotonic()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self.lock:
+            # Every key ever seen would stay in attempts forever, and with random
+            # usernames (exactly what an attacker sends) that's a lot of keys.
+            # So once per window the keys without recent attempts are dropped.
+            if now - self.last_sweep >= self.window:
+                self.sweep(now)
+            times = self.attempts.setdefault(key, deque())
+            while times and times[0] <= now - self.window:
+                times.popleft()
+            if len(times) >= self.limit:
+                return False
+            times.append(now)
+            return True
+
+    def sweep(self, now):
+        # Must be called with the lock held.
+        self.last_sweep = now
+        for key in [k for k, times in self.attempts.items() if not times or times[-1] <= now - self.window]:
+            del self.attempts[key]
+
+ip_limiter = SlidingWindowLimiter(limit=20, window=60)
+user_limiter = SlidingWindowLimiter(limit=5, window=60)
+
+# The failed passwords are remembered as a keyed hash (HMAC), never in plain text.
+failed_key = secrets.token_bytes(32)
+recent_failures = MemoryCache(max_items=10000)
+
+def valid_login(username, password):
+    if not ip_limiter.allow(request.remote_addr) or not user_limiter.allow(username):
+        abort(429)
+
+    attempt = hmac.new(failed_key, f'{username}\0{password}'.encode(), 'sha256').hexdigest()
+    if recent_failures.get(attempt) is not None:
+        return False
+
+    pwhash = users.get(username, DUMMY_HASH)
+    valid = password_pool.submit(check_password_hash, pwhash, password).result()
+    if not valid or username not in users:
+        recent_failures.set(attempt, '', ttl=300)
+        return False
+    return True
+
+def log_the_user_in(username):
+    return f'Welcome back, {escape(username)}!'
+
+# Note that the per username limit also means that an attacker can keep a real
+# user from logging in for a minute, that's why it's quite a bit higher than 1.
+# In a real app the limits would be shared between all worker processes,
+# for example by keeping them in Redis.
+
+# The same login as an async view (Flask 2.0+, pip install flask[async]).
+# The slow hash check runs in another thread (and process) while the view awaits
+# it. Also see asgi.py for serving the apps with an ASGI server.
+# (asyncio is only imported on the first request, which makes starting faster.)
+@app.route('/login6', methods=['POST', 'GET'])
+async def login6():
+    import asyncio
+    error = None
+    if request.method == 'POST':
+        username, password = request.form['username'], request.form['password']
+        if await asyncio.to_thread(valid_login, username, password):
+            return log_the_user_in(username)
+        error = 'Invalid username/password'
+    return render_template('hello.html', name=error)
+
+
+
+# --References--
+# werkzeug.security: https://werkzeug.palletsprojects.com/en/1.0.x/utils/#module-werkzeug.security
+# ProcessPoolExecutor: https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+# hmac: https://docs.python.org/3/library/hmac.html
+# 429 Too Many Requests: https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/429
+# Using async and await: https://flask.palletsprojects.com/en/2.0.x/async-await/
+# asyncio.to_thread(): https://docs.python.org/3/library/asyncio-task.html#asyncio.to_thread
+
+
+
+
+
+# Metrics
+# To see where the time of the requests goes, visit /metrics. See metrics.py.
+from metrics import init_metrics
+
+init_metrics(app)
@@ -3,6 +3,7 @@
 #1 File Uploads
 #2 Cookies
 #3 Redirects and Errors
+#4 Server Side Sessions
 
 
 # --Basic Flask Setup--
@@ -61,12 +62,724 @@ def upload_file2():
 # https://flask.palletsprojects.com/en/1.1.x/patterns/fileuploads/#uploading-files
 
 
+# Streaming Uploads
+# Note that by the time upload_file or upload_file2 runs, Werkzeug has already
+# read the whole multipart body and buffered it in memory or a temporary file.
+# That is fine for small files, but for really big ones (think multiple GB)
+# you'd rather write the file to its destination while it's still coming in.
+
+# To do that you must NOT touch request.files or request.form, because that
+# would make Werkzeug parse (and buffer) the whole body. Instead read the raw
+# body from request.stream a chunk at a time and feed it to Werkzeug's
+# incremental multipart parser, the MultipartDecoder.
+# The decoder hands you 'events': a File event when a file part starts,
+# then Data events with pieces of its content, and an Epilogue at the end.
+# MultipartDecoder is available since Werkzeug 2.1.
+import os
+import tempfile
+from flask import abort
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (
+    MultipartDecoder, Epilogue, NeedData, Field, File, Data
+)
+
+app.config['UPLOAD_FOLDER'] = '/data/uploads'
+# How much of the body is read (and so kept in memory) at a time.
+app.config['UPLOAD_CHUNK_SIZE'] = 64 * 1024
+# Biggest file we accept, checked while the file is streaming in.
+app.config['UPLOAD_MAX_SIZE'] = 4 * 1024 * 1024 * 1024
+
+def iter_upload(field_name='the_file'):
+    # Yields (filename, data) for every piece of the file sent in field_name.
+    # Only the first part named field_name is used, like request.files[field_name].
+    content_type, options = parse_options_header(request.headers.get('Content-Type', ''))
+    boundary = options.get('boundary')
+    if content_type != 'multipart/form-data' or not boundary:
+        abort(400)
+
+    chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+    max_size = app.config['UPLOAD_MAX_SIZE']
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    filename = None
+    seen = False
+    received = 0
+    while True:
+        chunk = request.stream.read(chunk_size)
+        # Passing None tells the decoder that the body has ended.
+        decoder.receive_data(chunk or None)
+        try:
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File) and event.name == field_name and not seen:
+                    filename = event.filename
+                    seen = True
+                elif isinstance(event, (Field, File)):
+                    filename = None
+                elif isinstance(event, Data) and filename is not None:
+                    received += len(event.data)
+                    if received > max_size:
+                        abort(413) # 413 means Request Entity Too Large
+                    yield filename, event.data
+                event = decoder.next_event()
+        except ValueError:
+            # The decoder raises ValueError on a broken or cut off body.
+            abort(400)
+        if isinstance(event, Epilogue) or not chunk:
+            return
+
+def save_upload(field_name='the_file'):
+    # Streams the file into UPLOAD_FOLDER and returns the path it was saved to.
+    # It's written to a temporary file first and only moved into place once it
+    # arrived completely, so a failed upload (too big, connection dropped, ...)
+    # never destroys an earlier file with the same name.
+    filename = None
+    tmp = tempfile.NamedTemporaryFile(dir=app.config['UPLOAD_FOLDER'], delete=False)
+    try:
+        with tmp:
+            for filename, data in iter_upload(field_name):
+                tmp.write(data)
+        filename = secure_filename(filename or '')
+        if not filename:
+            abort(400)
+        path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        os.replace(tmp.name, path)
+    finally:
+        # Don't leave half written files lying around if something went wrong.
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+    return path
+
+@app.route('/upload3', methods=['POST'])
+def upload_file3():
+    save_upload()
+    return 'Saved'
+
+# This way at most UPLOAD_CHUNK_SIZE bytes of the file are in memory at once,
+# no matter how big the uploaded file is.
+# You can see it for yourself by uploading a big file to both endpoints
+# and watching the memory usage (RSS) of the server process:
+# >head -c 2G /dev/urandom > big.bin
+# >curl -F "the_file=@big.bin" 127.0.0.1:5000/upload2
+# >curl -F "the_file=@big.bin" 127.0.0.1:5000/upload3
+# >ps -o rss= -p <server pid>
+# If you just want to limit the size of uploads, setting MAX_CONTENT_LENGTH
+# in the app config is enough, Flask will then reject bigger requests with a 413.
+
+
+# Content Addressed Uploads
+# upload_file2 stores every file under its (secured) client filename, so
+# uploading the same file again rewrites it completely and two clients that
+# send different files with the same name overwrite each other.
+# Another way is to store files by a hash of their content (their 'digest')
+# and keep a separate index that maps the filename to that digest.
+# The same content is then only ever stored once.
+
+# The hash is calculated while the file streams in (using iter_upload from
+# above), so the file is only read once. Because the digest is only known at
+# the end, the file is first written to a temporary file which is either moved
+# into place or, if that content is already stored, simply deleted.
+# Files are spread over sub folders named after the first characters of their
+# digest (blobs/ab/cd/abcd...), so no folder ends up with millions of files.
+# They're kept in their own BLOB_FOLDER, not in UPLOAD_FOLDER, where an upload
+# named 'blobs' or 'names' would get in the way.
+import hashlib
+import tempfile
+
+app.config['BLOB_FOLDER'] = '/data/blobs'
+
+def blob_path(digest):
+    return os.path.join(app.config['BLOB_FOLDER'], 'blobs', digest[:2], digest[2:4], digest)
+
+def index_path(filename):
+    return os.path.join(app.config['BLOB_FOLDER'], 'names', filename)
+
+@app.route('/upload4', methods=['POST'])
+def upload_file4():
+    sha256 = hashlib.sha256()
+    filename = None
+    # The temporary files are made in BLOB_FOLDER too, os.replace() can only
+    # move files within the same filesystem.
+    os.makedirs(app.config['BLOB_FOLDER'], exist_ok=True)
+    tmp = tempfile.NamedTemporaryFile(dir=app.config['BLOB_FOLDER'], delete=False)
+    try:
+        with tmp:
+            for filename, data in iter_upload():
+                sha256.update(data)
+                tmp.write(data)
+        filename = secure_filename(filename or '')
+        if not filename:
+            abort(400)
+
+        digest = sha256.hexdigest()
+        path = blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # os.replace() is atomic, other requests either see the whole
+            # file or no file at all.
+            os.replace(tmp.name, path)
+    finally:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+
+    # The index is just a file per name containing the digest.
+    # It's written the same way, to a temporary file that is moved into place.
+    os.makedirs(os.path.dirname(index_path(filename)), exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=app.config['BLOB_FOLDER'], delete=False) as f:
+        f.write(digest)
+    os.replace(f.name, index_path(filename))
+    return 'Saved'
+
+# To get the file back, look up its digest in the index first:
+# with open(index_path(filename)) as f:
+#     path = blob_path(f.read())
+
+
+# Processing Uploads In The Background
+# Anything you do with a file after saving it (checksumming, scanning it for
+# viruses, making thumbnails, ...) makes the client wait longer for a response.
+# Instead you can hand that work to a pool of worker threads and answer right
+# away with 202 Accepted and a job id. The client can then ask /jobs/<job_id>
+# how far the processing is.
+
+# The steps are plain functions that take the path of the saved file, so you can
+# add your own to post_upload_steps. What they return is stored in the job.
+# If the work is CPU heavy (e.g. thumbnails), a ProcessPoolExecutor works the same way.
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+def checksum(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(app.config['UPLOAD_CHUNK_SIZE']), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def virus_scan(path):
+    # Stand-in for a real scanner.
+    return 'clean'
+
+post_upload_steps = [checksum, virus_scan]
+
+executor = ThreadPoolExecutor(max_workers=4)
+# At most this many jobs can be queued or running at once. When all slots are
+# taken new uploads are turned away, instead of letting the queue grow forever.
+job_slots = threading.BoundedSemaphore(16)
+jobs = {}
+
+# Finished jobs are kept for JOB_TTL seconds so the client can still see the
+# result, after that they're removed, otherwise jobs would grow forever.
+# finished_at is in the order the jobs finished, so the oldest ones come first.
+JOB_TTL = 3600
+finished_at = {}
+jobs_lock = threading.Lock()
+
+def expire_jobs():
+    now = time.monotonic()
+    with jobs_lock:
+        for job_id, finished in list(finished_at.items()):
+            if now - finished < JOB_TTL:
+                break
+            del finished_at[job_id]
+            del jobs[job_id]
+
+def post_process(job_id, path):
+    # The job is only changed with jobs_lock held, so job_status() never sees it half updated.
+    job = jobs[job_id]
+    with jobs_lock:
+        job['status'] = 'running'
+    try:
+        for step in post_upload_steps:
+            result = step(path)
+            with jobs_lock:
+                job['results'][step.__name__] = result
+                job['done'] += 1
+        with jobs_lock:
+            job['status'] = 'finished'
+    except Exception as e:
+        with jobs_lock:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+    finally:
+        with jobs_lock:
+            finished_at[job_id] = time.monotonic()
+        job_slots.release()
+
+@app.route('/upload5', methods=['POST'])
+def upload_file5():
+    if not job_slots.acquire(blocking=False):
+        # 503 means Service Unavailable, Retry-After tells the client when to try again.
+        return 'Too many uploads are being processed, try again later.', 503, {'Retry-After': '5'}
+    try:
+        path = save_upload()
+    except BaseException:
+        job_slots.release()
+        raise
+
+    expire_jobs()
+    job_id = uuid.uuid4().hex
+    with jobs_lock:
+        jobs[job_id] = {'status': 'queued', 'done': 0, 'steps': len(post_upload_steps), 'results': {}}
+    executor.submit(post_process, job_id, path)
+    return {'job_id': job_id}, 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    # Copy the job while holding the lock, it may be expired or updated right after.
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is not None:
+            job = dict(job, results=dict(job['results']))
+    if job is None:
+        abort(404)
+    return job
+
+# Note that jobs only lives in the memory of this one process, so it's lost on
+# restart and isn't shared between multiple worker processes. For that you'd
+# use a real task queue like Celery, see the Celery pattern in the docs.
+
+
+# Async Uploads
+# upload_file2 as an async view (Flask 2.0+, pip install flask[async]).
+# FileStorage.save() writes to disk and would block the event loop, so it's
+# run in a thread with asyncio.to_thread(). Also see asgi.py for serving the
+# apps with an ASGI server.
+# (asyncio is only imported on the first request, which makes starting faster.)
+@app.route('/upload6', methods=['POST'])
+async def upload_file6():
+    import asyncio
+    f = request.files['the_file']
+    filename = secure_filename(f.filename)
+    if not filename:
+        abort(400)
+    await asyncio.to_thread(f.save, os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    return 'Saved'
+
+
+# Chunked Uploads
+# With a single POST, a connection that drops at 90% means sending the whole
+# file again. Instead a client can send the file in numbered chunks, each in
+# its own request. Chunks can be sent in parallel (several connections at once
+# get more out of a slow or far away link) and in any order, and after a
+# dropped connection only the missing chunks have to be sent again.
+#1 POST /chunked with {"filename": ..., "size": ...} starts an upload and
+#  returns its upload_id, the chunk_size and how many chunks to send.
+#2 PUT /chunked/<upload_id>/<index> sends chunk number index (counting from 0),
+#  the body is the raw data of the chunk.
+#3 GET /chunked/<upload_id> lists the chunks that were received so far.
+#4 POST /chunked/<upload_id>/complete moves the file into UPLOAD_FOLDER.
+
+# The file is created at its full size right when the upload starts
+# (preallocated), and every chunk is written straight to its place in that
+# file with os.pwrite(), which writes at a given position. So there are no
+# chunk files that have to be copied together at the end, completing an
+# upload is just a rename.
+# Every upload is kept on disk (not in memory), in CHUNKED_UPLOAD_FOLDER:
+# <upload_id>.json with the filename and size, <upload_id>.part with the data
+# and a folder <upload_id>.chunks with an empty file for every chunk that was
+# completely written. So it works with multiple worker processes and an
+# upload can even be resumed after the server restarted.
+# CHUNKED_UPLOAD_FOLDER is separate from UPLOAD_FOLDER, so unfinished uploads
+# can't be downloaded and can't collide with uploaded files, but it has to be on
+# the same filesystem, otherwise completing an upload can't be a rename.
+import json
+import re
+import shutil
+
+app.config['CHUNKED_UPLOAD_FOLDER'] = '/data/chunked-uploads'
+app.config['CHUNKED_UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024
+
+def chunked_path(upload_id, suffix):
+    # upload_id comes from the URL, only accept ids that we could have made.
+    if not re.fullmatch('[0-9a-f]{32}', upload_id):
+        abort(404)
+    return os.path.join(app.config['CHUNKED_UPLOAD_FOLDER'], upload_id + suffix)
+
+def load_chunked_upload(upload_id):
+    try:
+        with open(chunked_path(upload_id, '.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        abort(404)
+
+def preallocate(fd, size):
+    # Reserves the space on disk up front, so the upload can't fail halfway
+    # because the disk is full and the file isn't fragmented.
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        # posix_fallocate() doesn't exist on macOS and Windows, and not every
+        # filesystem supports it. Setting the size at least creates a (sparse) file.
+        os.ftruncate(fd, size)
+
+def received_chunks(upload_id):
+    try:
+        return sorted(int(name) for name in os.listdir(chunked_path(upload_id, '.chunks')))
+    except FileNotFoundError:
+        abort(404) # Another request completed it just now.
+
+@app.route('/chunked', methods=['POST'])
+def start_chunked_upload():
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename', '')))
+    size = data.get('size')
+    if not filename or not isinstance(size, int) or size < 0:
+        abort(400)
+    if size > app.config['UPLOAD_MAX_SIZE']:
+        abort(413)
+
+    upload_id = uuid.uuid4().hex
+    chunk_size = app.config['CHUNKED_UPLOAD_CHUNK_SIZE']
+    os.makedirs(chunked_path(upload_id, '.chunks'))
+    fd = os.open(chunked_path(upload_id, '.part'), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        if size:
+            preallocate(fd, size)
+    finally:
+        os.close(fd)
+    # Written last, an upload only exists once everything else is in place.
+    with open(chunked_path(upload_id, '.json'), 'w') as f:
+        json.dump({'filename': filename, 'size': size, 'chunk_size': chunk_size}, f)
+    return {'upload_id': upload_id, 'chunk_size': chunk_size,
+            'chunks': -(-size // chunk_size)}, 201 # -(-a // b) rounds up
+
+@app.route('/chunked/<upload_id>/<int:index>', methods=['PUT'])
+def put_chunk(upload_id, index):
+    upload = load_chunked_upload(upload_id)
+    offset = index * upload['chunk_size']
+    if offset >= upload['size']:
+        abort(404)
+    # Every chunk is chunk_size bytes, except maybe the last one.
+    length = min(upload['chunk_size'], upload['size'] - offset)
+    if request.content_length != length:
+        abort(400)
+
+    try:
+        fd = os.open(chunked_path(upload_id, '.part'), os.O_WRONLY)
+    except FileNotFoundError:
+        abort(404) # Completed in the meantime.
+    try:
+        written = 0
+        while written < length:
+            data = request.stream.read(min(app.config['UPLOAD_CHUNK_SIZE'], length - written))
+            if not data:
+                abort(400) # The connection dropped, the client will send it again.
+            view = memoryview(data)
+            while view:
+                # pwrite() may write less than it was given, just like write().
+                count = os.pwrite(fd, view, offset + written)
+                view = view[count:]
+                written += count
+    finally:
+        os.close(fd)
+    # Only marked as received once all of it is written.
+    try:
+        open(os.path.join(chunked_path(upload_id, '.chunks'), str(index)), 'w').close()
+    except FileNotFoundError:
+        abort(404)
+    return '', 204
+
+@app.route('/chunked/<upload_id>')
+def chunked_upload_status(upload_id):
+    upload = load_chunked_upload(upload_id)
+    return {**upload, 'received': received_chunks(upload_id)}
+
+@app.route('/chunked/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    upload = load_chunked_upload(upload_id)
+    chunks = -(-upload['size'] // upload['chunk_size'])
+    missing = sorted(set(range(chunks)) - set(received_chunks(upload_id)))
+    if missing:
+        # 409 means Conflict, the upload isn't in a state where it can be completed.
+        return {'missing': missing}, 409
+
+    try:
+        fd = os.open(chunked_path(upload_id, '.part'), os.O_RDONLY)
+    except FileNotFoundError:
+        abort(404)
+    try:
+        os.fsync(fd) # Makes sure the data is on disk before the file shows up.
+    finally:
+        os.close(fd)
+    try:
+        os.replace(chunked_path(upload_id, '.part'),
+                   os.path.join(app.config['UPLOAD_FOLDER'], upload['filename']))
+    except FileNotFoundError:
+        abort(404) # Another request completed it just now.
+    os.remove(chunked_path(upload_id, '.json'))
+    shutil.rmtree(chunked_path(upload_id, '.chunks'))
+    return {'filename': upload['filename']}
+
+# A client that gets an error or a dropped connection on some chunk only has to
+# ask GET /chunked/<upload_id> which chunks are missing and send those again.
+# Uploads that are never completed stay in CHUNKED_UPLOAD_FOLDER, so clean it
+# up now and then, e.g. with a cron job that removes files older than a day.
+
+
+# Bulk Uploads
+# Sending thousands of small files one request at a time means thousands of
+# requests, each with its own HTTP overhead. Instead a client can pack them
+# into a tar or zip archive and send that as the body of a single request:
+# >tar -czf - photos/ | curl -T - -H "Content-Type: application/x-tar" 127.0.0.1:5000/bulk
+# >curl --data-binary @photos.zip -H "Content-Type: application/zip" 127.0.0.1:5000/bulk
+
+# A tar archive is read while it streams in, the files in it are stored one
+# after the other, each behind a small header with its name and size.
+# tarfile's stream mode ('r|*') reads it like that, without ever seeking back,
+# and handles gzip, bzip2 and xz compressed archives too.
+# A zip archive keeps its list of files at the very end, so it's first saved
+# to a temporary file and only then read.
+
+# Every member name goes through secure_filename() (which also flattens
+# folders, 'photos/cat.jpg' is saved as 'photos_cat.jpg'). Anything that isn't
+# a regular file (folders, links, devices) is skipped.
+# Small files are read into memory and written to disk by a pool of threads,
+# while the request thread already reads the next one from the archive.
+# bulk_slots limits how many of those writes can wait at once, which also
+# limits the memory they use. Bigger files are copied straight to disk.
+
+# The response is streamed too, one line of JSON per file as soon as it's
+# saved, and a summary at the end. Because the status code is sent before the
+# archive is read, errors are reported in those lines and not with a status.
+import json
+import shutil
+import tarfile
+import zipfile
+from collections import deque
+from flask import Response, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Files up to this size are written by the thread pool.
+app.config['BULK_INLINE_SIZE'] = 1024 * 1024
+
+bulk_executor = ThreadPoolExecutor(max_workers=8)
+bulk_slots = threading.BoundedSemaphore(64)
+
+def iter_archive():
+    # Yields (name, size, file, error) for every member, file is None if it's not a regular file
+    # or if it can't be opened, error says why.
+    if request.mimetype in ('application/zip', 'application/x-zip-compressed'):
+        with tempfile.TemporaryFile(dir=app.config['UPLOAD_FOLDER']) as tmp:
+            # A zip has its index at the end, so it's spooled to disk first. The whole archive
+            # is copied here, so the size limit has to be checked here too.
+            max_size = app.config['UPLOAD_MAX_SIZE']
+            copied = 0
+            while chunk := request.stream.read(app.config['UPLOAD_CHUNK_SIZE']):
+                copied += len(chunk)
+                if copied > max_size:
+                    raise RequestEntityTooLarge()
+                tmp.write(chunk)
+            with zipfile.ZipFile(tmp) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        yield info.filename, 0, None, None
+                        continue
+                    try:
+                        f = archive.open(info)
+                    except (RuntimeError, NotImplementedError) as e:
+                        # Encrypted members and unsupported compression methods.
+                        yield info.filename, info.file_size, None, str(e)
+                        continue
+                    with f:
+                        yield info.filename, info.file_size, f, None
+    else:
+        with tarfile.open(fileobj=request.stream, mode='r|*') as archive:
+            for member in archive:
+                # In stream mode a member has to be read before moving on to the next one.
+                yield member.name, member.size, archive.extractfile(member) if member.isfile() else None, None
+
+def save_file(path, source):
+    # Like save_upload(), the file is written to a temporary file and only moved
+    # into place once it's complete. So a member that is cut off never leaves half
+    # a file behind, or destroys an earlier file with the same name.
+    tmp = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False)
+    try:
+        with tmp:
+            if isinstance(source, bytes):
+                tmp.write(source)
+            else:
+                shutil.copyfileobj(source, tmp, app.config['UPLOAD_CHUNK_SIZE'])
+        os.replace(tmp.name, path)
+    finally:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+
+def write_file(path, data):
+    try:
+        save_file(path, data)
+    finally:
+        bulk_slots.release()
+
+def finished_results(pending, summary, wait=False):
+    # Yields the results in the order of the archive, as far as they're done.
+    while pending and (wait or pending[0][1] is None or pending[0][1].done()):
+        result, future = pending.popleft()
+        if future is not None:
+            try:
+                future.result()
+                result['status'] = 'saved'
+            except OSError as e:
+                result.update(status='error', error=str(e))
+        summary[result['status']] += 1
+        yield json.dumps(result) + '\n'
+
+@app.route('/bulk', methods=['POST'])
+def bulk_upload():
+    folder = app.config['UPLOAD_FOLDER']
+    inline_size = app.config['BULK_INLINE_SIZE']
+    max_size = app.config['UPLOAD_MAX_SIZE']
+
+    def ingest():
+        summary = {'saved': 0, 'skipped': 0, 'error': 0}
+        pending = deque() # (result, future) pairs
+        saved_names = set()
+        total = 0
+        try:
+            for name, size, f, error in iter_archive():
+                result = {'name': name}
+                future = None
+                filename = secure_filename(name)
+                if error:
+                    result.update(status='error', error=error)
+                elif f is None:
+                    result['status'] = 'skipped'
+                elif not filename or filename in saved_names:
+                    result.update(status='error', error='Invalid or duplicate name')
+                elif total + size > max_size:
+                    result.update(status='error', error='Too big')
+                else:
+                    saved_names.add(filename)
+                    total += size
+                    result.update(saved_as=filename, size=size)
+                    path = os.path.join(folder, filename)
+                    try:
+                        if size <= inline_size:
+                            data = f.read()
+                            bulk_slots.acquire() # Waits while too many writes are queued.
+                            future = bulk_executor.submit(write_file, path, data)
+                        else:
+                            save_file(path, f)
+                            result['status'] = 'saved'
+                    except (OSError, zipfile.BadZipFile) as e:
+                        # OSError from writing, BadZipFile from a zip member with a bad CRC.
+                        result.update(status='error', error=str(e))
+                    except (tarfile.TarError, EOFError) as e:
+                        # The archive ends in the middle of this member, it gets its own
+                        # line before the archive is reported as broken.
+                        result.update(status='error', error=str(e))
+                        pending.append((result, None))
+                        raise
+                pending.append((result, future))
+                yield from finished_results(pending, summary)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+            pending.append(({'status': 'error', 'error': f'Broken archive: {e}'}, None))
+        except RequestEntityTooLarge:
+            pending.append(({'status': 'error', 'error': 'Archive too big'}, None))
+        yield from finished_results(pending, summary, wait=True)
+        yield json.dumps({'summary': summary}) + '\n'
+
+    # stream_with_context() keeps the request around while the response is sent,
+    # ingest() reads the archive from it.
+    return Response(stream_with_context(ingest()), mimetype='application/x-ndjson')
+
+
+# Downloading Uploaded Files
+# send_from_directory() sends a file from a folder, and makes sure the filename
+# can't be used to escape from that folder (like '../../etc/passwd').
+# It also handles Range requests: a client can ask for just a part of the file
+# (Range: bytes=1000-) to resume a download, and gets a 206 Partial Content.
+from flask import send_from_directory
+
+@app.route('/uploads/<path:filename>')
+def download_file(filename):
+    # Sends big files in bigger pieces, see PreadFileWrapper below.
+    request.environ.setdefault('wsgi.file_wrapper', PreadFileWrapper)
+    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+
+# How the file is actually sent depends on the server:
+# - If the WSGI server provides 'wsgi.file_wrapper' (gunicorn does), the open
+#   file is handed to it, and it uses os.sendfile() to let the kernel copy the
+#   file straight to the socket without it ever passing through Python.
+# - With USE_X_SENDFILE = True, Flask doesn't send the file at all, it only sets an
+#   X-Sendfile header and the web server in front (Apache, lighttpd) sends it.
+#   (nginx uses a X-Accel-Redirect header for the same thing.)
+# - Otherwise Werkzeug reads the file in Python, 8KB at a time.
+
+# For that last case, here's a file wrapper that reads the file in 1MB pieces
+# instead, which means far fewer trips through Python for big files. Werkzeug
+# uses whatever is in environ['wsgi.file_wrapper'], so download_file() only sets
+# it when the server has none.
+# os.pread() reads from a given position without moving the file position. If
+# the file is made shorter while it's being sent (someone uploads a new version
+# with the same name), it just returns less, and the download ends early.
+# (Mapping the file into memory with mmap would be a bit faster, but touching a
+# mapped page that was cut off the file kills the whole process with SIGBUS.)
+class PreadFileWrapper:
+    # Werkzeug always passes a buffer_size of 8KB, which is what it reads at a
+    # time itself, so anything smaller than 1MB is replaced with 1MB.
+    MIN_BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, file, buffer_size=8192):
+        self.file = file
+        self.buffer_size = max(buffer_size, self.MIN_BUFFER_SIZE)
+        self.position = 0
+
+    # seek() and tell() let Werkzeug jump straight to the start of a Range request.
+    def seekable(self):
+        return True
+
+    def seek(self, position):
+        self.position = position
+
+    def tell(self):
+        return self.position
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = os.pread(self.file.fileno(), self.buffer_size, self.position)
+        if not chunk:
+            raise StopIteration()
+        self.position += len(chunk)
+        return chunk
+
+    def close(self):
+        self.file.close()
+
+# The static endpoint (see Static Files in Quickstart-2) sends its files with
+# send_from_directory() too, but it doesn't set the wrapper, static files are
+# small and better left to the web server in front.
+
+
 
 # --References--
 # save(): https://werkzeug.palletsprojects.com/en/1.0.x/datastructures/#werkzeug.datastructures.FileStorage.save
 # f.filename: https://werkzeug.palletsprojects.com/en/1.0.x/datastructures/#werkzeug.datastructures.FileStorage.filename
 # secure_filename(): https://werkzeug.palletsprojects.com/en/1.0.x/utils/#werkzeug.utils.secure_filename
 # Better Examples: https://flask.palletsprojects.com/en/1.1.x/patterns/fileuploads/#uploading-files
+# request.stream: https://flask.palletsprojects.com/en/2.3.x/api/#flask.Request.stream
+# MultipartDecoder: https://github.com/pallets/werkzeug/blob/main/src/werkzeug/sansio/multipart.py
+# MAX_CONTENT_LENGTH: https://flask.palletsprojects.com/en/1.1.x/config/#MAX_CONTENT_LENGTH
+# hashlib: https://docs.python.org/3/library/hashlib.html
+# tempfile: https://docs.python.org/3/library/tempfile.html
+# os.replace(): https://docs.python.org/3/library/os.html#os.replace
+# ThreadPoolExecutor: https://docs.python.org/3/library/concurrent.futures.html#threadpoolexecutor
+# BoundedSemaphore: https://docs.python.org/3/library/threading.html#threading.BoundedSemaphore
+# Celery: https://flask.palletsprojects.com/en/1.1.x/patterns/celery/
+# Using async and await: https://flask.palletsprojects.com/en/2.0.x/async-await/
+# asyncio.to_thread(): https://docs.python.org/3/library/asyncio-task.html#asyncio.to_thread
+# os.pwrite(): https://docs.python.org/3/library/os.html#os.pwrite
+# os.posix_fallocate(): https://docs.python.org/3/library/os.html#os.posix_fallocate
+# tarfile: https://docs.python.org/3/library/tarfile.html
+# zipfile: https://docs.python.org/3/library/zipfile.html
+# stream_with_context(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.stream_with_context
+# send_from_directory(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.send_from_directory
+# USE_X_SENDFILE: https://flask.palletsprojects.com/en/1.1.x/config/#USE_X_SENDFILE
+# wsgi.file_wrapper: https://peps.python.org/pep-3333/#optional-platform-specific-file-handling
+# X-Accel-Redirect: https://www.nginx.com/resources/wiki/start/topics/examples/xsendfile/
+# os.pread(): https://docs.python.org/3/library/os.html#os.pread
 
 
 
@@ -143,6 +856,55 @@ def cookies():
 # For this also see About Responses.
 
 
+# Reading One Cookie Quickly
+# The first time request.cookies is used, Werkzeug parses the whole Cookie header
+# into a dict. When the browser sends a lot of cookies (think of all the
+# analytics cookies some sites set) and the view needs only one of them, most
+# of that work is wasted.
+# get_cookie() looks for just the one cookie in the raw header and only parses that.
+from functools import lru_cache
+from werkzeug.http import dump_cookie, parse_cookie
+
+def get_cookie(name, default=None):
+    header = request.environ.get('HTTP_COOKIE', '')
+    key = name + '='
+    start = header.find(key)
+    while start != -1:
+        # Make sure it's the whole name and not the end of another one (like 'xusername=').
+        if start == 0 or header[start - 1] in '; ':
+            end = header.find(';', start)
+            if end == -1:
+                end = len(header)
+            return parse_cookie(header[start:end]).get(name, default)
+        start = header.find(key, start + len(key))
+    return default
+
+# Setting a cookie works the other way around: set_cookie() builds the Set-Cookie
+# header (quoting the value, adding Path=/ and so on) on every call. For a cookie
+# that's always the same, the header can be built once and reused.
+@lru_cache(maxsize=128)
+def cookie_header(key, value, **options):
+    return dump_cookie(key, value, **options)
+
+# Going one step further, a HeaderTemplate (see header_templates.py) keeps the
+# finished Set-Cookie header around, so it's not even added to a new Headers
+# object on every request.
+from header_templates import HeaderTemplate, TemplatedResponse
+
+username_cookie = HeaderTemplate([('Set-Cookie', cookie_header('username', 'John Doe'))])
+
+@app.route('/cookies2', methods=['GET', 'POST'])
+def cookies2():
+    username = get_cookie('username')
+    if username is not None:
+        return render_template('cookies.html', username=username)
+    else:
+        return TemplatedResponse(render_template('cookies.html'), header_template=username_cookie)
+
+# Note that get_cookie() can be fooled by a quoted value that contains ';' and
+# another cookie name, in that rare case just use request.cookies.
+
+
 
 # --References List--
 # Cookies: https://flask.palletsprojects.com/en/1.1.x/api/#flask.Request.cookies
@@ -150,6 +912,8 @@ def cookies():
 # make_response(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.make_response
 # Deferred Request Callbacks: https://flask.palletsprojects.com/en/1.1.x/patterns/deferredcallbacks/#deferred-callbacks
 # Responses: https://flask.palletsprojects.com/en/1.1.x/quickstart/#about-responses
+# parse_cookie(): https://werkzeug.palletsprojects.com/en/1.0.x/http/#werkzeug.http.parse_cookie
+# dump_cookie(): https://werkzeug.palletsprojects.com/en/1.0.x/http/#werkzeug.http.dump_cookie
 
 
 
@@ -199,3 +963,253 @@ def page_not_found(error):
 # errorhandler(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.Flask.errorhandler
 # render_template(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.render_template
 # Error handlers: https://flask.palletsprojects.com/en/1.1.x/errorhandling/#error-handlers
+
+
+
+
+
+# Server Side Sessions
+# https://flask.palletsprojects.com/en/1.1.x/api/#session-interface
+# Flask's default session keeps all of its data inside a signed cookie. That
+# cookie is sent with every request and decoded every time, even when the view
+# never looks at the session.
+# A server side session only puts a random session id in the cookie and keeps
+# the data itself on the server. You can plug one in by replacing
+# app.session_interface with your own SessionInterface.
+
+# The LazySession below only loads its data from the store the first time a view
+# actually reads or writes it, and it remembers whether it was changed, so the
+# data is only written back when that's needed.
+import json
+import secrets
+import sqlite3
+import time
+from flask import session
+from flask.sessions import SessionInterface, SessionMixin
+
+class LazySession(SessionMixin):
+    def __init__(self, store, sid=None):
+        self.store = store
+        self.sid = sid
+        self.old_sid = None
+        self.new = sid is None
+        self.modified = False
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self.store.get(self.sid) if self.sid is not None else None
+            if self._data is None:
+                # An id the store doesn't know (expired, or made up by someone)
+                # is never used, the session gets a new id when it's saved.
+                # Otherwise an attacker could set a victim's cookie to an id
+                # they know and read the session after the victim logs in
+                # (that's called session fixation).
+                self._data = {}
+                self.sid = None
+                self.new = True
+        return self._data
+
+    def regenerate(self):
+        # Gives the session a new id, keeping its data. Call it whenever the
+        # user logs in, so an id from before the login is worth nothing.
+        self.data # Loads the data before the id is forgotten
+        if self.sid is not None:
+            self.old_sid = self.sid
+            self.sid = None
+        self.modified = True
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        return LazySession(self.store, request.cookies.get(self.get_cookie_name(app)))
+
+    def save_session(self, app, session, response):
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session.modified:
+            return
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.old_sid is not None:
+            self.store.delete(session.old_sid)
+        if not session:
+            # The session was emptied, e.g. with session.clear() on logout.
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.sid is None:
+            # secrets makes ids that can't be guessed.
+            session.sid = secrets.token_urlsafe(32)
+            response.set_cookie(
+                name, session.sid, domain=domain, path=path,
+                httponly=self.get_cookie_httponly(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+        self.store.set(session.sid, dict(session), app.permanent_session_lifetime.total_seconds())
+
+# A store needs get(sid), set(sid, data, ttl), delete(sid) and sweep(), which
+# removes expired sessions.
+# MemorySessionStore keeps sessions in this process. It's split into shards,
+# each with its own lock, so requests for different sessions rarely wait on
+# each other.
+class MemorySessionStore:
+    def __init__(self, shards=16):
+        self.shards = [({}, threading.Lock()) for _ in range(shards)]
+
+    def shard(self, sid):
+        return self.shards[hash(sid) % len(self.shards)]
+
+    def get(self, sid):
+        sessions, lock = self.shard(sid)
+        with lock:
+            item = sessions.get(sid)
+        if item is None or item[0] < time.time():
+            return None
+        return dict(item[1]) # A copy, so changes only count after set()
+
+    def set(self, sid, data, ttl):
+        sessions, lock = self.shard(sid)
+        with lock:
+            sessions[sid] = (time.time() + ttl, dict(data))
+
+    def delete(self, sid):
+        sessions, lock = self.shard(sid)
+        with lock:
+            sessions.pop(sid, None)
+
+    def sweep(self):
+        now = time.time()
+        for sessions, lock in self.shards:
+            with lock:
+                for sid in [sid for sid, (expires, _) in sessions.items() if expires < now]:
+                    del sessions[sid]
+
+# SQLiteSessionStore keeps sessions in a file, so they survive restarts and are
+# shared by all worker processes. The data has to be JSON serializable.
+# A sqlite connection must not be used in more than one process, so it's only
+# opened when it's first needed, and a forked worker (see serve.py) forgets the
+# one it inherited and opens its own.
+class SQLiteSessionStore:
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def connection(self):
+        # Call with self.lock held.
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self.conn:
+                self.conn.execute('CREATE TABLE IF NOT EXISTS sessions '
+                                  '(sid TEXT PRIMARY KEY, expires REAL, data TEXT)')
+        return self.conn
+
+    def get(self, sid):
+        with self.lock:
+            row = self.connection().execute('SELECT data FROM sessions WHERE sid = ? AND expires >= ?',
+                                            (sid, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, sid, data, ttl):
+        with self.lock, self.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)',
+                         (sid, time.time() + ttl, json.dumps(data)))
+
+    def delete(self, sid):
+        with self.lock, self.connection() as conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def sweep(self):
+        with self.lock, self.connection() as conn:
+            conn.execute('DELETE FROM sessions WHERE expires < ?', (time.time(),))
+
+# Expired sessions are already ignored by get(), the sweeper just makes sure
+# they don't pile up. It runs in a background (daemon) thread.
+# Threads don't survive fork(), so when serve.py forks its workers from the
+# master every worker has to start its own sweeper.
+def start_sweeper(store, interval=60):
+    def sweep_forever():
+        while True:
+            time.sleep(interval)
+            store.sweep()
+
+    def start():
+        threading.Thread(target=sweep_forever, daemon=True).start()
+
+    start()
+    os.register_at_fork(after_in_child=start)
+
+session_store = MemorySessionStore()
+# Or: session_store = SQLiteSessionStore(os.path.join(app.instance_path, 'sessions.sqlite'))
+app.session_interface = ServerSideSessionInterface(session_store)
+start_sweeper(session_store)
+
+# Sessions are used like a dict, just like the normal ones.
+@app.route('/login5', methods=['POST'])
+def login5():
+    # Check the password here, see login3 in Quickstart-2.
+    session.regenerate()
+    session['username'] = request.form['username']
+    return 'Logged in'
+
+@app.route('/logout')
+def logout():
+    session.clear()
+    return 'Logged out'
+
+@app.route('/whoami')
+def whoami():
+    return f"You're {session.get('username', 'nobody')}."
+
+# Requests to views that never use the session (like index) don't load it and
+# don't write it back, so they cost nothing extra.
+# How long sessions live is set by PERMANENT_SESSION_LIFETIME (31 days by default).
+
+
+
+# --References--
+# Session Interface: https://flask.palletsprojects.com/en/1.1.x/api/#session-interface
+# session: https://flask.palletsprojects.com/en/1.1.x/api/#flask.session
+# PERMANENT_SESSION_LIFETIME: https://flask.palletsprojects.com/en/1.1.x/config/#PERMANENT_SESSION_LIFETIME
+# secrets: https://docs.python.org/3/library/secrets.html
+
+
+
+
+
+# Metrics
+# To see where the time of the requests goes, visit /metrics. See metrics.py.
+from metrics import init_metrics
+
+init_metrics(app)
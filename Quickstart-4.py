@@ -1,6 +1,8 @@
 # src: https://flask.palletsprojects.com/en/1.1.x/quickstart
 # This part Contains The Following:
 #1 About Responses
+#2 Precomputed Error Pages
+#3 Fast JSON Responses
 
 # --Basic Flask Setup--
 from flask import Flask
@@ -60,3 +62,259 @@ def not_found(error):
 
 # The header value can be seen through:
 # Inspect > Network > All > Name > Some subpath > Headers > Response Headers
+
+
+
+
+
+# Precomputed Error Pages
+# Bots scanning for things like /wp-admin can cause a lot of 404s, and every one
+# of them renders 404_error_page.html again even though the page is always the same.
+# Because the page only depends on the error, it can be rendered once per
+# distinct error message and the result kept around. While at it, the
+# compressed versions and an ETag can be computed once as well.
+
+# The precomputed() decorator below does that for an error handler. The handler
+# still decides what the page looks like (including extra headers like
+# X-Something), it's just only called the first time each error is seen.
+# An error message can contain request data (abort(404, f'No user {name}')),
+# so only the max_pages most recently used pages are kept, otherwise every
+# distinct URL a bot tries would add a page.
+# brotli is an optional package (pip install brotli), without it only gzip is used.
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request
+from header_templates import HeaderTemplate, TemplatedResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def precomputed(handler, max_pages=64):
+    pages = OrderedDict()
+    lock = threading.Lock()
+
+    @wraps(handler)
+    def wrapper(error):
+        key = str(error)
+        with lock:
+            page = pages.get(key)
+            if page is not None:
+                pages.move_to_end(key) # Mark as most recently used
+        if page is None:
+            resp = make_response(handler(error))
+            body = resp.get_data()
+            page = {
+                'status': resp.status_code,
+                'content_type': resp.content_type,
+                # The rest of the headers (like X-Something) never change, so they
+                # go in a HeaderTemplate, see header_templates.py. Content-Length
+                # is left out because it depends on the encoding.
+                'headers': HeaderTemplate(
+                    [(k, v) for k, v in resp.headers if k.lower() not in ('content-length', 'content-type')]
+                    + [('Vary', 'Accept-Encoding')]),
+                'etag': hashlib.sha1(body).hexdigest(),
+                'bodies': {'identity': body},
+            }
+            compressed = {'gzip': gzip.compress(body)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(body)
+            # Very small pages can get bigger when compressed, those aren't worth it.
+            for encoding, data in compressed.items():
+                if len(data) < len(body):
+                    page['bodies'][encoding] = data
+            with lock:
+                pages[key] = page
+                while len(pages) > max_pages:
+                    pages.popitem(last=False)
+
+        encoding = request.accept_encodings.best_match(list(page['bodies']), default='identity')
+        resp = TemplatedResponse(page['bodies'][encoding], page['status'],
+                                 content_type=page['content_type'], header_template=page['headers'])
+        if encoding != 'identity':
+            resp.headers['Content-Encoding'] = encoding
+        # Every encoding is a different body, so it needs its own ETag.
+        resp.set_etag(f"{page['etag']}-{encoding}")
+        # Answers with 304 Not Modified when the client sends a matching If-None-Match.
+        return resp.make_conditional(request)
+    return wrapper
+
+# Like with route(), precomputed() has to be placed below errorhandler().
+# (It replaces the not_found handler from above, an app can only have one handler per code.)
+@app.errorhandler(404)
+@precomputed
+def not_found(error):
+    resp = make_response(render_template('404_error_page.html'), 404)
+    resp.headers['X-Something'] = 'A Value'
+    return resp
+
+# The handler must not use anything else from the request (like request.path),
+# otherwise every visitor would get the page that was rendered for the first one.
+
+
+
+# Fast JSON Responses
+# When a view returns a dict (or a list) Flask turns it into JSON with app.json,
+# its 'JSON provider'. The default one uses the json module that comes with
+# Python. The provider can be replaced (Flask 2.2+), here with one that uses
+# orjson (pip install orjson) when it's installed, which is many times faster,
+# and otherwise falls back to the json module.
+# orjson also encodes straight to bytes, the body of the response, instead of
+# first building a str that then has to be encoded.
+import json
+import re
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 19 digits or more might not fit in 64 bits.
+LONG_NUMBER = re.compile(r'\d{19}')
+LONG_NUMBER_BYTES = re.compile(rb'\d{19}')
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps_bytes(self, obj):
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        if orjson is not None:
+            # The PASSTHROUGH options make orjson hand dates and dataclasses to
+            # default(), so they come out the same as with the json module.
+            option = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+                      | orjson.OPT_APPEND_NEWLINE)
+            if self.sort_keys:
+                # orjson sorts keys that aren't strings (like {10: .., 2: ..}) by their
+                # text, the json module by their value. Without OPT_NON_STR_KEYS
+                # orjson refuses them, so those dicts go to the json module below.
+                option |= orjson.OPT_SORT_KEYS
+            else:
+                option |= orjson.OPT_NON_STR_KEYS
+            if pretty:
+                option |= orjson.OPT_INDENT_2
+            try:
+                data = orjson.dumps(obj, default=self.default, option=option)
+            except orjson.JSONEncodeError:
+                data = None # Things orjson can't do, like integers over 64 bits.
+            # orjson quietly writes NaN and Infinity as null, the json module writes
+            # them as NaN and Infinity. Only output with a null in it can be
+            # affected, that's done again by the json module to be sure.
+            if data is not None and b'null' not in data:
+                return data
+        separators = None if pretty else (',', ':')
+        return (json.dumps(obj, default=self.default, ensure_ascii=self.ensure_ascii,
+                           sort_keys=self.sort_keys, indent=2 if pretty else None,
+                           separators=separators) + '\n').encode('utf-8')
+
+    # Also used for request.get_json(). orjson turns integers that don't fit in
+    # 64 bits into floats (losing digits) and doesn't accept NaN or Infinity,
+    # the json module handles both. So anything with a very long number in it,
+    # or that orjson can't read, goes to the json module instead.
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        if (LONG_NUMBER_BYTES if isinstance(s, (bytes, bytearray)) else LONG_NUMBER).search(s):
+            return super().loads(s)
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            return super().loads(s) # Raises the usual error if it really is broken
+
+    def response(self, *args, **kwargs):
+        # The same arguments as jsonify(): one value, several values or keywords.
+        if args and kwargs:
+            raise TypeError('Use either positional or keyword arguments, not both.')
+        obj = args[0] if len(args) == 1 else (args or kwargs or None)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
+# Flask sorts the keys of every dict by default, that takes time too. If the
+# order of the keys doesn't matter to your clients you can turn it off:
+# app.json.sort_keys = False
+# Note that orjson leaves characters like 'é' as they are instead of writing
+# them as '\u00e9', which is the same JSON, just shorter.
+
+
+# Faster Conversion Of Return Values
+# For every response make_response() goes through the checks from About
+# Responses above (is it a tuple? a string? a dict? ...) to find out how to
+# turn the return value into a response. The answer only depends on the type
+# of the value, so it can be worked out once per type and remembered.
+# The table is kept per type and not per endpoint, because one view can return
+# different things (like a dict, or a tuple with an error status).
+# Anything that isn't a string, dict, list or a simple tuple of those is left
+# to Flask's own make_response().
+flask_make_response = app.make_response
+
+def text_response(rv):
+    return app.response_class(rv)
+
+def json_response(rv):
+    return app.json.response(rv)
+
+def tuple_response(rv):
+    # Only (body, status) is handled here, e.g. return {'id': 1}, 201
+    if len(rv) == 2 and type(rv[1]) is int:
+        convert = conversions.get(type(rv[0])) or resolve_conversion(type(rv[0]))
+        if convert is not tuple_response and convert is not flask_make_response:
+            resp = convert(rv[0])
+            resp.status_code = rv[1]
+            return resp
+    return flask_make_response(rv)
+
+def resolve_conversion(kind):
+    # The same order of checks as Flask, done once per type.
+    if issubclass(kind, tuple):
+        convert = tuple_response
+    elif issubclass(kind, str):
+        convert = text_response
+    elif issubclass(kind, (dict, list)):
+        convert = json_response
+    else:
+        # Response objects, bytes, generators, WSGI applications, ...
+        convert = flask_make_response
+    conversions[kind] = convert
+    return convert
+
+conversions = {}
+
+def fast_make_response(rv):
+    convert = conversions.get(type(rv)) or resolve_conversion(type(rv))
+    return convert(rv)
+
+app.make_response = fast_make_response
+
+# Some views that return dicts, to try it out (also see benchmark.py):
+@app.route('/api/user/<int:user_id>')
+def api_user(user_id):
+    return {'id': user_id, 'name': f'User {user_id}', 'posts': list(range(20))}
+
+@app.route('/api/users', methods=['POST'])
+def api_create_user():
+    return {'id': 1, 'created': True}, 201
+
+
+
+# --References--
+# make_response(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.make_response
+# errorhandler(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.Flask.errorhandler
+# accept_encodings: https://werkzeug.palletsprojects.com/en/1.0.x/wrappers/#werkzeug.wrappers.AcceptMixin.accept_encodings
+# make_conditional(): https://werkzeug.palletsprojects.com/en/1.0.x/wrappers/#werkzeug.wrappers.ETagResponseMixin.make_conditional
+# ETag: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/ETag
+# brotli: https://pypi.org/project/Brotli/
+# JSON Provider: https://flask.palletsprojects.com/en/2.2.x/api/#flask.json.provider.JSONProvider
+# orjson: https://github.com/ijl/orjson
+
+
+
+
+
+# Metrics
+# To see where the time of the requests goes, visit /metrics. See metrics.py.
+from metrics import init_metrics
+
+init_metrics(app)
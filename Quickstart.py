@@ -6,6 +6,8 @@
 #4 Debug Mode
 #5 Variable Rules
 #6 Unique URLs and or Redirection Behavior
+#7 How URLs Are Matched
+#8 Loading Data For Variable Rules
 
 # Basic Setup or Minimal App
 # https://flask.palletsprojects.com/en/1.1.x/quickstart/#a-minimal-application
@@ -129,3 +131,221 @@ def about():
 # resources, which helps search engines avoid indexing the same page twice.
 
 # Canonical synonyms: legal, orthodox, approved, received, official.
+
+
+
+
+
+# How URLs Are Matched
+# Every request URL is matched against all the rules in app.url_map.
+# Older versions of Werkzeug (before 2.2) turned every rule into a regular
+# expression and tried them one after the other, so matching got slower with
+# every route you added.
+# Since Werkzeug 2.2 the rules are compiled into a tree (a 'state machine')
+# of URL segments instead: static segments like 'user' are looked up in a dict
+# and only then the converters (<username>, <int:post_id>, ...) are tried.
+# So the time it takes to match a URL stays about the same no matter how many
+# routes there are, and the trailing slash behavior above still works the same.
+
+# You can see that for yourself with this command, it times matching some of the
+# URLs above while adding more and more unrelated routes:
+# >flask bench-routing
+import timeit
+import click
+from werkzeug.exceptions import NotFound
+from werkzeug.routing import Map, Rule, RequestRedirect
+
+@app.cli.command('bench-routing')
+def bench_routing():
+    urls = ['/user/john', '/post/42', '/path/a/b/c', '/projects/', '/about']
+    rules = list(app.url_map.iter_rules())
+    for size in [0, 100, 1000, 10000]:
+        url_map = Map([rule.empty() for rule in rules])
+        for i in range(size):
+            url_map.add(Rule(f'/extra{i}/<name>', endpoint=f'extra{i}'))
+        adapter = url_map.bind('localhost')
+
+        # The behavior doesn't change with the size of the map.
+        try:
+            adapter.match('/projects')
+        except RequestRedirect as e:
+            if not e.new_url.endswith('/projects/'):
+                raise click.ClickException(f'/projects redirected to {e.new_url}')
+        else:
+            raise click.ClickException('/projects did not redirect to /projects/')
+        try:
+            adapter.match('/about/')
+        except NotFound:
+            pass
+        else:
+            raise click.ClickException('/about/ matched, it should be a 404')
+
+        seconds = timeit.timeit(lambda: [adapter.match(url) for url in urls], number=2000)
+        print(f'{size + len(rules):>6} routes: '
+              f'{seconds / (2000 * len(urls)) * 1e6:.2f} µs per match')
+
+
+
+# --References--
+# Routing: https://werkzeug.palletsprojects.com/en/2.2.x/routing/
+# Werkzeug 2.2 Changes: https://werkzeug.palletsprojects.com/en/2.2.x/changes/#version-2-2-0
+# Custom Commands: https://flask.palletsprojects.com/en/1.1.x/cli/#custom-commands
+
+
+
+
+
+# Loading Data For Variable Rules
+# show_user_profile and show_post above only hint at something like
+# database[username]. Here's what that could look like with SQLite, which
+# comes with Python. Also see the Using SQLite 3 with Flask pattern.
+# Create the database with:
+# >flask init-db
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import lru_cache
+
+app.config['DATABASE'] = os.path.join(app.instance_path, 'quickstart.sqlite')
+
+# Opening a new connection for every request is slow, so a few connections are
+# opened once and shared. A request borrows one and gives it back when done.
+class ConnectionPool:
+    def __init__(self, database, size=5):
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(sqlite3.connect(database, check_same_thread=False))
+
+    @contextmanager
+    def connection(self):
+        conn = self.connections.get() # Waits if all connections are in use
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+@lru_cache(maxsize=None)
+def get_pool():
+    os.makedirs(app.instance_path, exist_ok=True)
+    return ConnectionPool(app.config['DATABASE'])
+
+@app.cli.command('init-db')
+def init_db():
+    with get_pool().connection() as conn:
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, name TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS posts (id INTEGER PRIMARY KEY, title TEXT NOT NULL);
+        ''')
+
+# When a popular profile is requested by lots of clients at the same time,
+# running the same query for each of them is wasted work. The BatchLoader
+# collects all keys asked for within a short window (2ms by default) and then
+# runs ONE query for all of them: SELECT ... WHERE key IN (?, ?, ...).
+# Requests asking for the same key in that window share the same result.
+class BatchLoader:
+    def __init__(self, fetch_many, window=0.002):
+        self.fetch_many = fetch_many # Takes a list of keys, returns a dict
+        self.window = window
+        self.lock = threading.Lock()
+        self.pending = {} # key -> Future
+
+    def load(self, key):
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pending[key] = Future()
+                if len(self.pending) == 1: # First key of a new batch
+                    threading.Timer(self.window, self.dispatch).start()
+        return future.result()
+
+    def dispatch(self):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        try:
+            results = self.fetch_many(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+        else:
+            for key, future in batch.items():
+                future.set_result(results.get(key))
+
+def fetch_users(usernames):
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            f'SELECT username, name FROM users WHERE username IN ({",".join("?" * len(usernames))})',
+            usernames,
+        ).fetchall()
+    return dict(rows)
+
+def fetch_posts(post_ids):
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            f'SELECT id, title FROM posts WHERE id IN ({",".join("?" * len(post_ids))})',
+            post_ids,
+        ).fetchall()
+    return dict(rows)
+
+user_loader = BatchLoader(fetch_users)
+post_loader = BatchLoader(fetch_posts)
+
+from flask import abort
+
+@app.route('/user2/<username>')
+def show_user_profile2(username):
+    name = user_loader.load(username)
+    if name is None:
+        abort(404)
+    return f'User {escape(name)}'
+
+@app.route('/post2/<int:post_id>')
+def show_post2(post_id):
+    title = post_loader.load(post_id)
+    if title is None:
+        abort(404)
+    return f'Post {escape(title)}'
+
+# This only helps when the server handles requests concurrently (threads),
+# which the development server does by default. Note that each request waits up
+# to 'window' seconds longer, so keep it small.
+
+
+# Async Views
+# Views can also be 'async def' functions (Flask 2.0+, pip install flask[async]).
+# That lets a view wait on several things at once with asyncio, but anything
+# blocking (like user_loader.load(), which waits for the batch) still has to
+# be moved off the event loop, asyncio.to_thread() runs it in a thread for you.
+# Also see asgi.py for serving the apps with an ASGI server.
+# asyncio is imported in the view, it takes longer to import than the rest of
+# this file and is only needed once someone visits /user3.
+@app.route('/user3/<username>')
+async def show_user_profile3(username):
+    import asyncio
+    name = await asyncio.to_thread(user_loader.load, username)
+    if name is None:
+        abort(404)
+    return f'User {escape(name)}'
+
+
+
+# --References--
+# Using SQLite 3 with Flask: https://flask.palletsprojects.com/en/1.1.x/patterns/sqlite3/
+# sqlite3: https://docs.python.org/3/library/sqlite3.html
+# instance_path: https://flask.palletsprojects.com/en/1.1.x/config/#instance-folders
+# Future: https://docs.python.org/3/library/concurrent.futures.html#future-objects
+# threading.Timer: https://docs.python.org/3/library/threading.html#timer-objects
+# Using async and await: https://flask.palletsprojects.com/en/2.0.x/async-await/
+# asyncio.to_thread(): https://docs.python.org/3/library/asyncio-task.html#asyncio.to_thread
+
+
+
+
+
+# Metrics
+# To see where the time of the requests goes, visit /metrics. See metrics.py.
+from metrics import init_metrics
+
+init_metrics(app)
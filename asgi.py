@@ -0,0 +1,76 @@
+# Serving The Quickstart Apps With ASGI
+# WSGI servers (like the one 'flask run' starts) hand every request to a thread
+# and that thread is busy until the response is done. ASGI servers (like uvicorn
+# or hypercorn) run an event loop instead. This file exposes the same app
+# objects as ASGI applications:
+# >pip install flask[async] uvicorn
+# >uvicorn asgi:quickstart3
+# The names are quickstart, quickstart2, quickstart3 and quickstart4.
+
+# Note that Flask itself is still a WSGI framework, asgiref's WsgiToAsgi is what
+# makes it talk ASGI. Some things to know about it:
+#1 By default WsgiToAsgi runs ALL requests in one single thread, one after the
+#  other (sync_to_async with thread_sensitive=True). ThreadedWsgiToAsgi below
+#  runs each request in a thread of a pool instead, so they run side by side.
+#  Every request in progress still takes up a thread, and every async view gets
+#  its own event loop inside that thread.
+#2 It reads the whole request body (into memory, or a temporary file above
+#  64KB) before the app even starts. So the streaming uploads of Quickstart-3
+#  (/upload3, /bulk, ...) don't stream here, serve those with a WSGI server,
+#  see serve.py.
+# So you can use async views (see the Async Views parts of the Quickstarts) with
+# an ASGI server, but it's not faster than a WSGI server with threads.
+# If you need thousands of open connections per process, look at Quart, which
+# has the same API as Flask but is built on asyncio from the ground up.
+import importlib.util
+import os
+import sys
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APPS = {
+    'quickstart': 'Quickstart.py',
+    'quickstart2': 'Quickstart-2.py',
+    'quickstart3': 'Quickstart-3.py',
+    'quickstart4': 'Quickstart-4.py',
+}
+
+def load_app(filename):
+    # The file names have a '-' in them, so they can't be imported the normal way.
+    spec = importlib.util.spec_from_file_location(filename[:-3].replace('-', '_'),
+                                                  os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    # Flask finds the templates and static folder next to the module it was
+    # created in, by looking it up in sys.modules. Without this it would use
+    # the current directory instead.
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module.app
+
+# run_wsgi_app() is what calls the Flask app. It's the same function, just
+# wrapped with thread_sensitive=False, so it runs in a pool of threads.
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(
+            scope, receive, send
+        )
+
+# Only loads the app that was asked for, e.g. asgi.quickstart3 (PEP 562).
+def __getattr__(name):
+    if name not in APPS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    asgi_app = ThreadedWsgiToAsgi(load_app(APPS[name]))
+    globals()[name] = asgi_app
+    return asgi_app
+
+
+# --References--
+# ASGI: https://flask.palletsprojects.com/en/2.0.x/deploying/asgi/
+# Using async and await: https://flask.palletsprojects.com/en/2.0.x/async-await/
+# Quart: https://pgjones.gitlab.io/quart/
+# sync_to_async(): https://github.com/django/asgiref#synchronous-code--threads
+# Module __getattr__: https://peps.python.org/pep-0562/
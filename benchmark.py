@@ -0,0 +1,366 @@
+# Benchmarking The Quickstart Apps
+# Starts every Quickstart app in its own process under a local WSGI server,
+# sends it a scripted mix of requests for its routes and reports how many
+# requests per second it handled, the p50/p99 latency and the peak memory
+# (RSS) of the server process, as JSON.
+
+# Usage ('>' is only a prefix):
+# >python benchmark.py
+# >python benchmark.py Quickstart-3.py --duration 10 --concurrency 16 --output new.json
+# To compare against an earlier run, pass it as the baseline. Anything that got
+# more than --tolerance percent slower is listed and the exit code is 1:
+# >python benchmark.py --baseline old.json --tolerance 10
+
+# Peak RSS is read from /proc, so it's only reported on Linux.
+import argparse
+import http.client
+import importlib.util
+import io
+import json
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import lru_cache
+from urllib.parse import quote
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# Request bodies are functions too, they're only called by the client right
+# before a scenario runs. That way the server process (which imports this file
+# as well) never builds them, and they don't count towards its memory.
+@lru_cache(maxsize=None)
+def payload(size):
+    return os.urandom(size)
+
+def multipart(field_name, filename, size):
+    # Builds a multipart/form-data body like a browser would send it.
+    def build():
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode() + payload(size) + f'\r\n--{boundary}--\r\n'.encode()
+        return body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    return build
+
+def form(**fields):
+    return lambda: ('&'.join(f'{quote(k)}={quote(v)}' for k, v in fields.items()).encode(),
+                    {'Content-Type': 'application/x-www-form-urlencoded'})
+
+def tar_archive(count, size):
+    def build():
+        f = io.BytesIO()
+        with tarfile.open(fileobj=f, mode='w') as archive:
+            for i in range(count):
+                info = tarfile.TarInfo(f'files/{i}.bin')
+                info.size = size
+                archive.addfile(info, io.BytesIO(payload(size)))
+        return f.getvalue(), {'Content-Type': 'application/x-tar'}
+    return build
+
+def chunked_upload(conn):
+    # A whole chunked upload (see Quickstart-3): start it, send every chunk and
+    # complete it. Returns the response of the last request.
+    data = payload(1024 ** 2)
+    conn.request('POST', '/chunked', body=json.dumps({'filename': f'{uuid.uuid4().hex}.bin', 'size': len(data)}),
+                 headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    body = response.read()
+    if response.status != 201:
+        return response
+    upload = json.loads(body)
+    chunk_size = upload['chunk_size']
+    for index in range(upload['chunks']):
+        conn.request('PUT', f"/chunked/{upload['upload_id']}/{index}",
+                     body=data[index * chunk_size:(index + 1) * chunk_size])
+        response = conn.getresponse()
+        response.read()
+    conn.request('POST', f"/chunked/{upload['upload_id']}/complete")
+    response = conn.getresponse()
+    response.read()
+    return response
+
+def names():
+    return quote(random.choice(['john', 'jane', 'John Doe', 'élodie', 'x' * 50]))
+
+def not_found():
+    # Like the bots that scan for well known admin pages.
+    return f'/wp-admin/{random.randint(0, 10 ** 6)}.php'
+
+# Every scenario is (name, method, path, body, headers). The path may be a function
+# that's called for every request, so the requests aren't all the same.
+# The method can also be a function that sends a whole series of requests
+# itself, like chunked_upload() above.
+SCENARIOS = {
+    'Quickstart.py': [
+        ('index', 'GET', '/', None, {}),
+        ('hello', 'GET', '/hello', None, {}),
+        ('user', 'GET', lambda: f'/user/{names()}', None, {}),
+        ('post', 'GET', lambda: f'/post/{random.randint(1, 10 ** 6)}', None, {}),
+        ('path', 'GET', '/path/a/b/c', None, {}),
+        ('projects', 'GET', '/projects/', None, {}),
+        ('projects redirect', 'GET', '/projects', None, {}),
+        ('about', 'GET', '/about', None, {}),
+        ('404 storm', 'GET', not_found, None, {}),
+        ('user from sqlite', 'GET', lambda: f"/user2/{random.choice(['john', 'jane', 'nobody'])}", None, {}),
+        ('post from sqlite', 'GET', lambda: f'/post2/{random.randint(1, 200)}', None, {}),
+        ('user async', 'GET', lambda: f"/user3/{random.choice(['john', 'jane', 'nobody'])}", None, {}),
+    ],
+    'Quickstart-2.py': [
+        ('index', 'GET', '/', None, {}),
+        ('login', 'GET', '/login', None, {}),
+        ('profile', 'GET', lambda: f'/user/{names()}', None, {}),
+        ('hello', 'GET', lambda: f'/hello/{names()}', None, {}),
+        ('hello cached', 'GET', lambda: f'/hello2/{names()}', None, {}),
+        ('hello streamed', 'GET', lambda: f'/hello3/{names()}', None, {}),
+        ('users streamed', 'GET', lambda: f'/users/{random.randint(0, 9)}', None, {}),
+        ('users streamed gzip', 'GET', lambda: f'/users/{random.randint(0, 9)}', None, {'Accept-Encoding': 'gzip'}),
+        ('static', 'GET', '/static/style.css', None, {}),
+        ('static precompressed', 'GET', '/static/style.css', None, {'Accept-Encoding': 'gzip, br'}),
+        ('login3 form', 'GET', '/login3', None, {}),
+        ('login3 wrong password', 'POST', '/login3', form(username='john', password='wrong'), {}),
+        ('login6 async form', 'GET', '/login6', None, {}),
+        ('404 storm', 'GET', not_found, None, {}),
+    ],
+    'Quickstart-3.py': [
+        ('index', 'GET', '/', None, {}),
+        ('set cookies', 'GET', '/set_cookies', None, {}),
+        ('cookies first visit', 'GET', '/cookies', None, {}),
+        ('cookies round trip', 'GET', '/cookies', None, {'Cookie': 'username=John Doe'}),
+        ('cookies2 first visit', 'GET', '/cookies2', None, {}),
+        ('session', 'GET', '/whoami', None, {}),
+        ('404 storm', 'GET', not_found, None, {}),
+        ('upload 1KB', 'POST', '/upload3', multipart('the_file', 'small.bin', 1024), {}),
+        ('upload 1MB', 'POST', '/upload3', multipart('the_file', 'medium.bin', 1024 ** 2), {}),
+        ('upload 16MB', 'POST', '/upload3', multipart('the_file', 'big.bin', 16 * 1024 ** 2), {}),
+        ('upload content addressed 1MB', 'POST', '/upload4', multipart('the_file', 'medium.bin', 1024 ** 2), {}),
+        ('upload with background job', 'POST', '/upload5', multipart('the_file', 'small.bin', 1024), {}),
+        ('upload async 1KB', 'POST', '/upload6', multipart('the_file', 'small.bin', 1024), {}),
+        ('chunked upload 1MB', chunked_upload, None, None, {}),
+        ('bulk upload 1000 files', 'POST', '/bulk', tar_archive(1000, 1024), {}),
+        ('download 1MB', 'GET', '/uploads/download.bin', None, {}),
+        ('download range', 'GET', '/uploads/download.bin', None, {'Range': 'bytes=1000-1999'}),
+    ],
+    'Quickstart-4.py': [
+        ('index', 'GET', '/', None, {}),
+        ('404 storm', 'GET', not_found, None, {}),
+        ('404 storm gzip', 'GET', not_found, None, {'Accept-Encoding': 'gzip'}),
+        ('json', 'GET', lambda: f'/api/user/{random.randint(1, 10 ** 6)}', None, {}),
+        ('json created', 'POST', '/api/users', None, {}),
+    ],
+}
+
+
+# --The Server Side--
+# Run by the benchmark itself in a separate process, so the memory it reports
+# is only the memory of the app:
+# >python benchmark.py --serve Quickstart.py --port 5001
+def serve(app_file, port):
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, HERE)
+    spec = importlib.util.spec_from_file_location('app_module', os.path.join(HERE, app_file))
+    module = importlib.util.module_from_spec(spec)
+    # Flask finds the templates next to the module it was created in, by looking
+    # it up in sys.modules, see asgi.py.
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    app = module.app
+    if 'UPLOAD_FOLDER' in app.config:
+        # Don't fill up the real upload folder.
+        app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        app.config['BLOB_FOLDER'] = tempfile.mkdtemp()
+        app.config['CHUNKED_UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        app.config['CHUNKED_UPLOAD_CHUNK_SIZE'] = 256 * 1024
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], 'download.bin'), 'wb') as f:
+            f.write(os.urandom(1024 ** 2))
+    if 'DATABASE' in app.config:
+        # A fresh database with some users and posts.
+        app.config['DATABASE'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite')
+        app.test_cli_runner().invoke(args=['init-db'])
+        with sqlite3.connect(app.config['DATABASE']) as conn:
+            conn.executemany('INSERT INTO users VALUES (?, ?)', [('john', 'John Doe'), ('jane', 'Jane Doe')])
+            conn.executemany('INSERT INTO posts VALUES (?, ?)', [(i, f'Post {i}') for i in range(1, 101)])
+    # The repository has no static files, so the benchmark brings its own.
+    app.static_folder = tempfile.mkdtemp()
+    with open(os.path.join(app.static_folder, 'style.css'), 'w') as f:
+        f.write(''.join(f'.item-{i} {{ margin: {i % 10}px; color: #{i:06x}; }}\n' for i in range(500)))
+    if 'precompress-static' in app.cli.commands:
+        app.test_cli_runner().invoke(args=['precompress-static'])
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+def peak_rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'): # The 'high water mark' of the RSS
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def wait_for_server(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'The server on port {port} did not start')
+
+
+# --The Client Side--
+def run_scenario(port, scenario, duration, concurrency):
+    _, method, path, body, headers = scenario
+    if body is not None:
+        body, extra_headers = body()
+        headers = {**headers, **extra_headers}
+    latencies = []
+    statuses = Counter()
+    errors = Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < deadline:
+            url = path() if callable(path) else path
+            start = time.perf_counter()
+            try:
+                if callable(method):
+                    response = method(conn)
+                else:
+                    conn.request(method, url, body=body, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                with lock:
+                    errors[type(e).__name__] += 1
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    def percentile(percent):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))] * 1000, 3)
+    return {
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': percentile(50),
+        'p99_ms': percentile(99),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'errors': dict(errors),
+    }
+
+def benchmark_app(app_file, port, duration, concurrency):
+    # In its own process group, so the processes the app starts itself (like the
+    # password hashing pool of Quickstart-2) are stopped together with it.
+    server = subprocess.Popen([sys.executable, __file__, '--serve', app_file, '--port', str(port)],
+                              cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              start_new_session=True)
+    try:
+        wait_for_server(port)
+        scenarios = {}
+        for scenario in SCENARIOS[app_file]:
+            print(f'{app_file}: {scenario[0]}', file=sys.stderr)
+            scenarios[scenario[0]] = run_scenario(port, scenario, duration, concurrency)
+        return {'scenarios': scenarios, 'peak_rss_kb': peak_rss_kb(server.pid)}
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+
+
+# --Comparing With A Baseline--
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for app_file, app_results in results['apps'].items():
+        old_app = baseline.get('apps', {}).get(app_file)
+        if old_app is None:
+            continue
+        for name, new in app_results['scenarios'].items():
+            old = old_app['scenarios'].get(name)
+            if old is None:
+                continue
+            if old['throughput_rps'] and new['throughput_rps'] < old['throughput_rps'] * (1 - tolerance / 100):
+                regressions.append(f"{app_file} {name}: throughput {old['throughput_rps']} -> {new['throughput_rps']} req/s")
+            if old['p99_ms'] and new['p99_ms'] and new['p99_ms'] > old['p99_ms'] * (1 + tolerance / 100):
+                regressions.append(f"{app_file} {name}: p99 {old['p99_ms']} -> {new['p99_ms']} ms")
+        old_rss, new_rss = old_app.get('peak_rss_kb'), app_results.get('peak_rss_kb')
+        if old_rss and new_rss and new_rss > old_rss * (1 + tolerance / 100):
+            regressions.append(f'{app_file}: peak RSS {old_rss} -> {new_rss} KB')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Quickstart apps.')
+    parser.add_argument('apps', nargs='*', default=list(SCENARIOS), help='app files to benchmark (default: all)')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of client threads')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--output', help='write the results to this file instead of printing them')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=10, help='percent that counts as a regression')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    results = {
+        'python': sys.version.split()[0],
+        'duration': args.duration,
+        'concurrency': args.concurrency,
+        'apps': {app_file: benchmark_app(app_file, args.port, args.duration, args.concurrency)
+                 for app_file in args.apps},
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['regressions'] = find_regressions(results, json.load(f), args.tolerance)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if results.get('regressions'):
+        print('\n'.join(['Regressions:'] + results['regressions']), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
+
+
+# --References--
+# http.client: https://docs.python.org/3/library/http.client.html
+# make_server(): https://werkzeug.palletsprojects.com/en/1.0.x/serving/#werkzeug.serving.make_server
+# VmHWM: https://man7.org/linux/man-pages/man5/proc.5.html
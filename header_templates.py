@@ -0,0 +1,59 @@
+# Header Templates
+# A small helper for views (and error handlers) that send the same extra
+# headers on every response. Normally those are added one by one:
+# resp = make_response(body)
+# resp.headers['X-Something'] = 'A Value'
+# and every add checks the name and value again and adds it to a new Headers
+# object, on every single request.
+
+# A HeaderTemplate does that work once, when it's created, and keeps the
+# finished headers in a tuple that never changes. A TemplatedResponse sends
+# those headers followed by its own ones (Content-Type, Content-Length and
+# whatever the view adds), which are put into a new list for every response,
+# so the shared template itself is never modified:
+# from header_templates import HeaderTemplate, TemplatedResponse
+# not_found_headers = HeaderTemplate({'X-Something': 'A Value'})
+# return TemplatedResponse(body, 404, header_template=not_found_headers)
+
+# If a response has a header of its own with the same name as one in the
+# template, its own one wins and the one from the template is left out.
+# Set-Cookie is the exception, every cookie is sent.
+
+# Note that the template headers are only added when the response is sent, so
+# they aren't in resp.headers (after_request functions don't see them).
+from flask import Response
+from werkzeug.datastructures import Headers
+
+
+class HeaderTemplate:
+    def __init__(self, headers):
+        # Headers() checks the names and values (no newlines, ...) once, here.
+        self.items = tuple(Headers(headers).to_wsgi_list())
+        self.names = frozenset(name.lower() for name, _ in self.items if name.lower() != 'set-cookie')
+
+    def wsgi_list(self, own):
+        # 'own' is the list of headers the response itself is sending.
+        if any(name.lower() in self.names for name, _ in own):
+            overridden = {name.lower() for name, _ in own}
+            return [item for item in self.items if item[0].lower() not in overridden] + own
+        return [*self.items, *own]
+
+
+class TemplatedResponse(Response):
+    def __init__(self, *args, header_template=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.header_template = header_template
+
+    # Werkzeug calls this to get the status and the final list of headers
+    # that are handed to the WSGI server.
+    def get_wsgi_response(self, environ):
+        app_iter, status, headers = super().get_wsgi_response(environ)
+        if self.header_template is not None:
+            headers = self.header_template.wsgi_list(headers)
+        return app_iter, status, headers
+
+
+# --References--
+# Headers: https://werkzeug.palletsprojects.com/en/1.0.x/datastructures/#werkzeug.datastructures.Headers
+# get_wsgi_response(): https://werkzeug.palletsprojects.com/en/1.0.x/wrappers/#werkzeug.wrappers.BaseResponse.get_wsgi_response
+# start_response(): https://peps.python.org/pep-3333/#the-start-response-callable
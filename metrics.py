@@ -0,0 +1,211 @@
+# Request Metrics
+# A small helper that can be used by all of the Quickstart apps to see where the
+# time of a request goes. Add it to an app with:
+# from metrics import init_metrics
+# init_metrics(app)
+# And then visit /metrics (only answers requests coming from the same machine).
+
+# It records:
+#1 How long each endpoint takes, in a histogram.
+#2 How long each template takes to render.
+#3 Which kind of value the views and error handlers returned (string, dict,
+#  tuple, Response, ...), that's what decides how Flask converts it into a
+#  response, see Quickstart-4. Every request is counted once.
+# And optionally a sampling profiler, see the bottom of this file.
+
+# All of it is meant to be cheap enough to leave on: a few time.perf_counter()
+# calls per request and some counters, no matter how many requests there are.
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from flask import abort, g, request
+from flask.signals import before_render_template, template_rendered
+
+
+# An HDR (High Dynamic Range) style histogram. Instead of keeping every value
+# it counts values in buckets, so it uses the same (small) amount of memory
+# whether it saw ten requests or ten million. Buckets get wider as the values
+# get bigger, so every value is off by at most 1/16 (about 6%).
+# Values are in microseconds.
+class Histogram:
+    SUB_BUCKETS = 16
+
+    def __init__(self, max_shift=40):
+        self.counts = [0] * (self.SUB_BUCKETS * (max_shift + 2))
+        self.total = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def bucket(self, value):
+        if value < self.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - 5 # Keeps the top 5 bits of the value
+        index = (shift + 1) * self.SUB_BUCKETS + (value >> shift) - self.SUB_BUCKETS
+        return min(index, len(self.counts) - 1)
+
+    def bucket_value(self, index):
+        if index < self.SUB_BUCKETS:
+            return index
+        shift = index // self.SUB_BUCKETS - 1
+        return (index % self.SUB_BUCKETS + self.SUB_BUCKETS) << shift
+
+    def record(self, value):
+        value = max(int(value), 0)
+        index = self.bucket(value)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += 1
+            self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        target = self.total * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return self.bucket_value(index)
+        return 0
+
+    def summary(self):
+        return {
+            'count': self.total,
+            'p50_us': self.percentile(50),
+            'p90_us': self.percentile(90),
+            'p99_us': self.percentile(99),
+            'max_us': self.max,
+        }
+
+
+def response_kind(rv):
+    # The same order of checks Flask goes through in make_response().
+    if isinstance(rv, tuple):
+        return f'tuple of {len(rv)}'
+    if isinstance(rv, (str, bytes)):
+        return 'string'
+    if isinstance(rv, dict):
+        return 'dict'
+    if isinstance(rv, list):
+        return 'list'
+    if hasattr(rv, '__next__'):
+        return 'generator'
+    if hasattr(rv, 'status_code'):
+        return 'Response'
+    return 'WSGI application'
+
+
+def init_metrics(app, profile=False):
+    endpoints = defaultdict(Histogram)
+    templates = defaultdict(Histogram)
+    response_kinds = Counter()
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.teardown_request
+    def stop_timer(error=None):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            # 404s and other routing errors don't have an endpoint.
+            endpoints[request.endpoint or 'no endpoint'].record((time.perf_counter() - start) * 1e6)
+
+    # Flask sends these signals before and after every render_template() call.
+    def start_render(sender, template, context, **extra):
+        g.setdefault('metrics_renders', []).append(time.perf_counter())
+
+    def stop_render(sender, template, context, **extra):
+        renders = g.get('metrics_renders')
+        if renders:
+            templates[template.name].record((time.perf_counter() - renders.pop()) * 1e6)
+
+    # weak=False because the functions only live in here.
+    before_render_template.connect(start_render, app, weak=False)
+    template_rendered.connect(stop_render, app, weak=False)
+
+    # finalize_request() gets the value returned by the view (or by the error
+    # handler) and turns it into a response with make_response().
+    # make_response() itself isn't wrapped, because views and helpers like
+    # flask.make_response() call it too, which would count one request many times.
+    finalize_request = app.finalize_request
+
+    def counting_finalize_request(rv, from_error_handler=False):
+        response_kinds[response_kind(rv)] += 1
+        return finalize_request(rv, from_error_handler)
+
+    app.finalize_request = counting_finalize_request
+
+    profiler = SamplingProfiler() if profile else None
+    if profiler is not None:
+        profiler.start()
+
+    def local_only():
+        if request.remote_addr not in ('127.0.0.1', '::1'):
+            abort(404)
+
+    @app.route('/metrics')
+    def metrics():
+        local_only()
+        return {
+            'endpoints': {name: h.summary() for name, h in endpoints.items()},
+            'templates': {name: h.summary() for name, h in templates.items()},
+            'response_kinds': dict(response_kinds),
+        }
+
+    @app.route('/metrics/profile')
+    def metrics_profile():
+        local_only()
+        if profiler is None:
+            abort(404)
+        return profiler.collapsed(), {'Content-Type': 'text/plain; charset=utf-8'}
+
+
+# Sampling Profiler
+# A normal profiler (like cProfile) records every single function call, which
+# makes everything a lot slower. A sampling profiler instead looks at what every
+# thread is doing every few milliseconds and counts how often it sees each
+# stack. Functions that show up a lot are where the time goes.
+# It's off by default, turn it on with init_metrics(app, profile=True).
+
+# /metrics/profile returns the stacks in the 'collapsed' format, one line per
+# stack like 'main;handle;view 42', which flamegraph.pl or speedscope can turn
+# into a flame graph:
+# >curl 127.0.0.1:5000/metrics/profile > stacks.txt
+# >flamegraph.pl stacks.txt > flamegraph.svg
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        # A copy, because the profiler thread keeps adding to it.
+        stacks = dict(self.stacks)
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.items())
+
+
+# --References--
+# Signals: https://flask.palletsprojects.com/en/1.1.x/signals/
+# before_request(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.Flask.before_request
+# teardown_request(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.Flask.teardown_request
+# make_response(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.Flask.make_response
+# finalize_request(): https://flask.palletsprojects.com/en/1.1.x/api/#flask.Flask.finalize_request
+# HdrHistogram: http://hdrhistogram.org/
+# Flame Graphs: https://www.brendangregg.com/flamegraphs.html
+# sys._current_frames(): https://docs.python.org/3/library/sys.html#sys._current_frames
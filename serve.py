@@ -0,0 +1,284 @@
+# Serving With Multiple Processes
+# 'flask run' starts a single process, so it can only use one CPU core (Python
+# runs one thread at a time per process). This launcher starts one worker
+# process per core instead, all answering requests on the same port:
+# >python serve.py Quickstart-3.py --bind 0.0.0.0:8000
+# >python serve.py Quickstart-2.py --workers 8 --max-requests 10000 --max-memory 512
+
+# How it works:
+#1 The master process opens the listening socket and imports the app, then
+#  forks the workers. Forked processes share the memory of the master until
+#  they change it (copy-on-write), so the app's code is only loaded once.
+#2 Every worker accepts connections from the shared socket, the kernel hands
+#  each new connection to one of them.
+#3 A worker that handled --max-requests requests or uses more than --max-memory
+#  MB stops after its current request and the master starts a fresh one.
+#  That keeps slow memory leaks in check.
+#4 kill -HUP <master pid> reloads the app: the master imports it again and
+#  replaces the workers one by one, starting the new one before stopping the
+#  old one. The socket stays open the whole time, so no request is refused.
+#  The files next to the app that it imports (like metrics.py) are imported
+#  again too, installed packages (like Flask) are not.
+#5 kill -TERM <master pid> (or Ctrl+C) lets the workers finish their current
+#  request and shuts everything down.
+
+#6 --profile-startup doesn't serve anything, it imports the app once and
+#  shows where the time went (see Startup Profile below).
+
+# Because the app is imported in the master, a new worker (after a crash, a
+# max-requests restart or a reload) starts without importing anything at all.
+
+# This uses os.fork(), so it only works on Linux/macOS. For real deployments
+# have a look at gunicorn, which does all of this (and more) the same way.
+import argparse
+import importlib.util
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_app(app_file, generation):
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE)
+    # The helpers the apps import (metrics.py, header_templates.py, ...) would
+    # otherwise stay in sys.modules and a reload would keep using the old code.
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None)
+        if name != '__main__' and path and os.path.dirname(os.path.abspath(path)) == HERE:
+            del sys.modules[name]
+    # A new module name for every reload, so the file is really imported again.
+    spec = importlib.util.spec_from_file_location(f'served_app_{generation}',
+                                                  os.path.join(HERE, app_file))
+    module = importlib.util.module_from_spec(spec)
+    # Flask finds the templates and static folder next to the module it was
+    # created in, by looking it up in sys.modules.
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module.app
+
+def rss_mb():
+    # The memory this process uses right now.
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except OSError:
+        import resource # The peak, on systems without /proc
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+# --Startup Profile--
+# >python serve.py Quickstart-2.py --profile-startup
+# Shows how long importing Flask itself took, and for the app file: every
+# import it does, registering its routes and the rest of its module level code
+# (like rendering templates or printing URLs at import time).
+def profile_startup(app_file):
+    import builtins
+    from collections import defaultdict
+
+    start = time.perf_counter()
+    import flask
+    flask_time = time.perf_counter() - start
+
+    imports = defaultdict(float)
+    routes = {'count': 0, 'time': 0.0}
+    depth = 0
+    original_import = builtins.__import__
+    original_add_url_rule = flask.Flask.add_url_rule
+
+    def timed_import(name, *args, **kwargs):
+        nonlocal depth
+        depth += 1
+        start = time.perf_counter()
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            depth -= 1
+            if depth == 0: # Nested imports are part of the one that started them.
+                imports[name] += time.perf_counter() - start
+
+    def timed_add_url_rule(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original_add_url_rule(self, *args, **kwargs)
+        finally:
+            routes['count'] += 1
+            routes['time'] += time.perf_counter() - start
+
+    builtins.__import__ = timed_import
+    flask.Flask.add_url_rule = timed_add_url_rule
+    try:
+        start = time.perf_counter()
+        load_app(app_file, 0)
+        total = time.perf_counter() - start
+    finally:
+        builtins.__import__ = original_import
+        flask.Flask.add_url_rule = original_add_url_rule
+
+    # Time spent registering routes that was also counted as part of an import
+    # (e.g. metrics.py adding /metrics) would otherwise be counted twice.
+    import_time = sum(imports.values())
+    other = max(total - import_time - routes['time'], 0)
+    ms = lambda seconds: f'{seconds * 1000:8.1f} ms'
+    print(f'Startup profile of {app_file}')
+    print(f'{ms(flask_time)}  importing flask')
+    print(f'{ms(total)}  importing {app_file}, of which:')
+    print(f'{ms(import_time)}    imports')
+    for name, seconds in sorted(imports.items(), key=lambda item: -item[1])[:15]:
+        print(f'{ms(seconds)}      {name}')
+    print(f"{ms(routes['time'])}    registering {routes['count']} routes")
+    print(f'{ms(other)}    other module level code')
+
+
+# Done once in the master, so no worker has to do it on its first requests.
+def warm_up(app):
+    # Loads (compiles) every template.
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+# --The Worker--
+def run_worker(app, sock, max_requests, max_memory):
+    from werkzeug.serving import make_server
+
+    stopping = False
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN) # Only the master reloads
+
+    handled = 0
+    def counting_app(environ, start_response):
+        nonlocal handled
+        handled += 1
+        return app(environ, start_response)
+
+    # One request at a time per worker, so stopping after the current request is easy.
+    server = make_server('', 0, counting_app, fd=sock.fileno())
+    server.timeout = 1 # handle_request() gives up after a second, to check 'stopping'
+    while not stopping:
+        server.handle_request()
+        if max_requests and handled >= max_requests:
+            break
+        if max_memory and rss_mb() > max_memory:
+            break
+    os._exit(0)
+
+
+# --The Master--
+class Master:
+    def __init__(self, app_file, sock, workers, max_requests, max_memory):
+        self.app_file = app_file
+        self.sock = sock
+        self.worker_count = workers
+        self.max_requests = max_requests
+        self.max_memory = max_memory
+        self.generation = 0
+        self.app = load_app(app_file, self.generation)
+        warm_up(self.app)
+        self.workers = {} # pid -> generation
+        self.reload_requested = False
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            # The worker must never get back into the master's loop, even when it
+            # crashes, otherwise it would start forking workers of its own.
+            try:
+                run_worker(self.app, self.sock, self.max_requests, self.max_memory)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(1)
+        self.workers[pid] = self.generation
+        return pid
+
+    def reap(self):
+        while self.workers:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            self.workers.pop(pid, None)
+
+    def current_workers(self):
+        return [pid for pid, generation in self.workers.items() if generation == self.generation]
+
+    def reload(self):
+        self.reload_requested = False
+        try:
+            app = load_app(self.app_file, self.generation + 1)
+        except Exception as e:
+            # Keep the old workers running if the new code doesn't even import.
+            print(f'Reload failed, keeping the running app: {e!r}', file=sys.stderr)
+            return
+        warm_up(app)
+        self.app = app
+        self.generation += 1
+        old_workers = [pid for pid, generation in self.workers.items() if generation < self.generation]
+        for pid in old_workers:
+            self.spawn()
+            os.kill(pid, signal.SIGTERM)
+
+    def stop(self):
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+        while self.workers:
+            pid, _ = os.wait()
+            self.workers.pop(pid, None)
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, 'reload_requested', True))
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, 'stopping', True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, 'stopping', True))
+        print(f'Master {os.getpid()} serving {self.app_file} on '
+              f'{self.sock.getsockname()} with {self.worker_count} workers', file=sys.stderr)
+        while not self.stopping:
+            self.reap()
+            if self.reload_requested:
+                self.reload()
+            # Replaces workers that stopped (max requests, max memory or a crash).
+            for _ in range(self.worker_count - len(self.current_workers())):
+                self.spawn()
+            time.sleep(0.2)
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a Quickstart app with multiple processes.')
+    parser.add_argument('app', help='the app file, e.g. Quickstart-3.py')
+    parser.add_argument('--bind', default='127.0.0.1:8000', help='host:port to listen on')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-requests', type=int, default=0, help='restart a worker after this many requests')
+    parser.add_argument('--max-memory', type=int, default=0, help='restart a worker above this many MB of RSS')
+    parser.add_argument('--profile-startup', action='store_true', help='only show where the startup time goes')
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        profile_startup(args.app)
+        return
+
+    host, port = args.bind.rsplit(':', 1)
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(1024)
+
+    Master(args.app, sock, args.workers, args.max_requests, args.max_memory).run()
+
+if __name__ == '__main__':
+    main()
+
+
+# --References--
+# os.fork(): https://docs.python.org/3/library/os.html#os.fork
+# make_server(): https://werkzeug.palletsprojects.com/en/1.0.x/serving/#werkzeug.serving.make_server
+# Deployment Options: https://flask.palletsprojects.com/en/1.1.x/deploying/
+# gunicorn: https://docs.gunicorn.org/en/stable/design.html